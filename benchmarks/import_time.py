@@ -0,0 +1,110 @@
+"""
+Startup import-time budget for the extraction entry points.
+
+Every file the watcher hands to ``test_runner.py --file`` (subprocess mode)
+pays the cost of importing test_runner before any work is done. This runs
+``python -X importtime -c "import <module>"`` in fresh interpreters, keeps
+the best of --repeat runs, and fails (exit code 1) when an entry point
+exceeds its budget or pulls in a heavy dependency at import time; pandas,
+numpy, openpyxl, pyarrow and streamlit must only load when actually used.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 10 --budget-ms test_runner=200
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time allowed per entry point (ms), with headroom over
+# what a warm-cache import measures on a typical server
+BUDGETS_MS = {
+    'test_runner': 150,
+    'utils.extractor': 100,
+}
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'pyarrow', 'streamlit')
+
+
+def measure(module):
+    """Return (total_ms, loaded module names) for one fresh interpreter import"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f"import sys, {module}; print(' '.join(sys.modules))"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        # Top-level entry (no indentation) for the module itself
+        if name.rstrip() == f" {module}":
+            total_us = int(cumulative)
+    # sys.modules, not the importtime log: failed optional imports appear there too
+    return total_us / 1000, set(proc.stdout.split())
+
+
+def check(module, budget_ms, repeat):
+    """Return (best_ms, problems) for one entry point"""
+    # The first run may compile bytecode; it is not representative
+    measure(module)
+    best, heavy = float('inf'), set()
+    for _ in range(repeat):
+        ms, imported = measure(module)
+        best = min(best, ms)
+        heavy |= {name for name in imported if name.split('.')[0] in HEAVY_MODULES}
+
+    problems = []
+    if best > budget_ms:
+        problems.append(f"{module}: {best:.1f}ms exceeds budget of {budget_ms}ms")
+    heavy_roots = sorted({name.split('.')[0] for name in heavy})
+    if heavy_roots:
+        problems.append(f"{module}: imports {', '.join(heavy_roots)} at load time")
+    return best, problems
+
+
+def parse_budget(text):
+    module, _, ms = text.partition('=')
+    if not ms:
+        raise argparse.ArgumentTypeError("expected MODULE=MS")
+    return module, float(ms)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check import-time budgets of the extraction entry points")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per module (best is kept)")
+    parser.add_argument('--budget-ms', type=parse_budget, action='append', default=[],
+                        metavar='MODULE=MS', help="Override or add a budget")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    budgets = dict(BUDGETS_MS)
+    budgets.update(args.budget_ms)
+
+    failures = []
+    print("Import time (best of %d):" % args.repeat)
+    for module, budget_ms in budgets.items():
+        best, problems = check(module, budget_ms, args.repeat)
+        print(f"  {module:<20}{best:>8.1f} ms  (budget {budget_ms:g} ms)")
+        failures.extend(problems)
+
+    if failures:
+        print("\nOVER BUDGET:")
+        for f in failures:
+            print(f"  {f}")
+        return 1
+    print("\nAll entry points within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
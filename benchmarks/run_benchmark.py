@@ -0,0 +1,232 @@
+"""
+Extractor throughput benchmark.
+
+Generates a synthetic SMITCH tree (see synthetic_workbooks.py), then measures:
+- time per detector on already-loaded sheet snapshots,
+- end-to-end extract_smitch_data_from_path: files/s and rows/s,
+- peak Python heap per file (tracemalloc, measured in a separate pass),
+and compares the result with benchmarks/baseline.json. Throughput or
+memory worse than the baseline by more than --tolerance, a detector slower
+by more than --detector-tolerance, or a different number of extracted rows
+exits with code 1.
+Logs and the layout cache go to the temp directory, never ./logs; the cache
+is off unless --layout-cache is given, so repeated passes time the
+detectors rather than cache hits.
+Baselines are machine specific; record one on the deployment server with
+--save-baseline before relying on the check there.
+
+Usage:
+    python benchmarks/run_benchmark.py
+    python benchmarks/run_benchmark.py --files 50 --extra-rows 2000
+    python benchmarks/run_benchmark.py --layout-cache
+    python benchmarks/run_benchmark.py --save-baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from benchmarks.synthetic_workbooks import EBIT_VARIANTS, generate_tree
+from config import Config
+from utils import extractor
+
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+# Per-sheet detector slowdowns smaller than this (ms) are not reported
+DETECTOR_NOISE_MS = 0.01
+# Each detector timing repetition loops over the sheets for at least this long
+DETECTOR_MIN_SECONDS = 0.05
+
+
+def time_detectors(snapshots, repeat):
+    """Best-of-``repeat`` milliseconds per sheet for each detector"""
+    layouts = []
+    for ws in snapshots:
+        categories = extractor.detect_categories(ws)
+        metric_cols, headers, _ = extractor.detect_metric_columns(ws)
+        subcategory_col = extractor.find_subcategory_column(ws, categories)
+        layouts.append((ws, categories, metric_cols, headers, subcategory_col))
+
+    detectors = {
+        'detect_metric_columns': lambda ws, cats, cols, hdrs, sub: extractor.detect_metric_columns(ws),
+        'detect_categories': lambda ws, cats, cols, hdrs, sub: extractor.detect_categories(ws),
+        'find_subcategory_column': lambda ws, cats, cols, hdrs, sub: extractor.find_subcategory_column(ws, cats),
+        'detect_plant': lambda ws, cats, cols, hdrs, sub: extractor.detect_plant(ws),
+        'detect_part_name': lambda ws, cats, cols, hdrs, sub: extractor.detect_part_name(ws, cats),
+        'extract_smitch_data': lambda ws, cats, cols, hdrs, sub: extractor.extract_smitch_data(ws, cats, cols, hdrs, sub),
+        'extract_weekly_apw': lambda ws, cats, cols, hdrs, sub: extractor.extract_weekly_apw(ws),
+        'extract_ebit_metrics': lambda ws, cats, cols, hdrs, sub: extractor.extract_ebit_metrics(ws, categories=cats),
+    }
+
+    def run(fn, loops):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for layout in layouts:
+                fn(*layout)
+        return time.perf_counter() - start
+
+    results = {}
+    for name, fn in detectors.items():
+        # A single pass over a few sheets is well below timer noise; loop enough
+        # passes to fill DETECTOR_MIN_SECONDS per repetition
+        loops = 1
+        while run(fn, loops) < DETECTOR_MIN_SECONDS:
+            loops *= 2
+        best = min(run(fn, loops) for _ in range(repeat))
+        results[name] = round(best / (loops * len(layouts)) * 1000, 4)
+    return results
+
+
+def time_end_to_end(paths, repeat):
+    best = float('inf')
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = sum(len(extractor.extract_smitch_data_from_path(p)) for p in paths)
+        best = min(best, time.perf_counter() - start)
+    return {
+        'seconds': round(best, 4),
+        'files_per_sec': round(len(paths) / best, 2),
+        'rows_per_sec': round(rows / best, 1),
+        'rows': rows,
+    }
+
+
+def peak_memory_mb(paths):
+    """Largest tracemalloc peak over single-file extractions"""
+    peak = 0
+    for p in paths:
+        tracemalloc.start()
+        extractor.extract_smitch_data_from_path(p)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 2)
+
+
+def compare(result, baseline, tolerance, detector_tolerance):
+    """Return a list of regression messages (empty when within tolerance)"""
+    regressions = []
+    old, new = baseline['end_to_end']['rows'], result['end_to_end']['rows']
+    if new != old:
+        regressions.append(f"extracted rows changed {old} -> {new}")
+    old, new = baseline['end_to_end']['files_per_sec'], result['end_to_end']['files_per_sec']
+    if new < old * (1 - tolerance):
+        regressions.append(f"files/s dropped {old} -> {new}")
+    old, new = baseline['peak_memory_mb'], result['peak_memory_mb']
+    if new > old * (1 + tolerance):
+        regressions.append(f"peak memory grew {old}MB -> {new}MB")
+    for name, old in baseline['detectors_ms'].items():
+        new = result['detectors_ms'].get(name)
+        # Differences below DETECTOR_NOISE_MS are timer noise, whatever the ratio
+        if new is not None and new > old * (1 + detector_tolerance) and new - old > DETECTOR_NOISE_MS:
+            regressions.append(f"{name} slower {old}ms -> {new}ms")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark SMITCH extraction on synthetic workbooks")
+    parser.add_argument('--files', type=int, default=20, help="Number of workbooks to generate")
+    parser.add_argument('--rows-per-category', type=int, default=6)
+    parser.add_argument('--extra-rows', type=int, default=500, help="Unrelated rows below the template")
+    parser.add_argument('--extra-cols', type=int, default=20, help="Unrelated columns right of the template")
+    parser.add_argument('--noise', type=float, default=0.1, help="Share of blank/stray-text value cells")
+    parser.add_argument('--no-ebit-rows', type=int, default=2000,
+                        help="Filler rows in the workbooks without an EBIT block")
+    parser.add_argument('--repeat', type=int, default=3, help="Timing repetitions (best is kept)")
+    parser.add_argument('--layout-cache', action='store_true',
+                        help="Extract with the template layout cache (a fresh one in the temp dir)")
+    parser.add_argument('--data-dir', help="Reuse/keep generated workbooks here instead of a temp dir")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed regression vs. baseline")
+    parser.add_argument('--detector-tolerance', type=float, default=0.5,
+                        help="Allowed per-detector slowdown vs. baseline")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="Write this run as the new baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {
+        'files': args.files,
+        'rows_per_category': args.rows_per_category,
+        'extra_rows': args.extra_rows,
+        'extra_cols': args.extra_cols,
+        'noise': args.noise,
+        'no_ebit_rows': args.no_ebit_rows,
+        'ebit_variants': [str(v) for v in EBIT_VARIANTS],
+        'layout_cache': args.layout_cache,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep timing logs and the layout cache out of the repository's ./logs
+        Config.LOG_PATH = os.path.join(tmp, 'logs')
+        Config.LAYOUT_CACHE = args.layout_cache
+        Config.LAYOUT_CACHE_PATH = os.path.join(Config.LOG_PATH, 'layout_cache.db')
+        data_dir = args.data_dir or tmp
+        print(f"Generating {args.files} workbook(s) in {data_dir} ...")
+        paths = generate_tree(
+            data_dir, n_files=args.files, rows_per_category=args.rows_per_category,
+            extra_rows=args.extra_rows, extra_cols=args.extra_cols, noise=args.noise,
+            no_ebit_rows=args.no_ebit_rows,
+        )
+
+        snapshots = [extractor.load_sheet_snapshot(p) for p in paths]
+        result = {
+            'params': params,
+            'machine': {'python': platform.python_version(), 'platform': platform.platform()},
+            'detectors_ms': time_detectors(snapshots, args.repeat),
+            'end_to_end': time_end_to_end(paths, args.repeat),
+            'peak_memory_mb': peak_memory_mb(paths),
+        }
+        if args.layout_cache:
+            from utils.layout_cache import default_cache
+            cache = default_cache()
+            if cache is not None:
+                # The temp dir cannot be removed on Windows while the database is open
+                cache.close()
+
+    print("\nDetector time per sheet (ms):")
+    for name, ms in result['detectors_ms'].items():
+        print(f"  {name:<26}{ms:>10.4f}")
+    e2e = result['end_to_end']
+    print(f"\nEnd to end: {e2e['files_per_sec']} files/s, {e2e['rows_per_sec']} rows/s "
+          f"({e2e['rows']} rows in {e2e['seconds']}s)")
+    print(f"Peak memory per file: {result['peak_memory_mb']} MB")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found; run with --save-baseline to record one.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('params') != params:
+        print("\nBaseline was recorded with different parameters; comparison skipped.")
+        return 0
+    if baseline.get('machine', {}).get('platform') != result['machine']['platform']:
+        print("\nWARNING: baseline was recorded on a different machine; throughput is not comparable.")
+
+    regressions = compare(result, baseline, args.tolerance, args.detector_tolerance)
+    if regressions:
+        print("\nREGRESSION vs. baseline:")
+        for r in regressions:
+            print(f"  {r}")
+        return 1
+    print("\nWithin tolerance of baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Synthetic SMITCH workbook generator for benchmarks.
+
+Produces .xlsx/.xlsm files that follow the plant SMITCH template closely
+enough for every detector to fire: a title block with plant and part name,
+metric header rows with dates, an S/M/I/T/C/H category column with
+subcategory rows, a Weekly APW cell and an OH/LAB EBIT block. Size and
+noise are configurable so throughput can be measured on small and large
+sheets alike. generate_tree mixes in workbooks without an EBIT block (with
+extra filler rows) and with one below the streaming scan window, the two
+layouts where the streaming loader has to decide how far to read.
+"""
+
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.extractor import KNOWN_PLANTS
+
+CATEGORIES = [
+    ('S', 'Sales Price'), ('M', 'Material'), ('I', 'Investment'),
+    ('T', 'Tooling'), ('C', 'Cycle Times'), ('H', 'Headcount'),
+]
+
+METRIC_HEADERS = [
+    "Quoted Cost Model\n{date}",
+    "Plex Standard {date}",
+    "Actual Performance {date}",
+    "Forecasted Cost {date}",
+    "Quoted JPH",
+    "Actual $ / piece",
+    "CM% margin",
+]
+STOP_HEADER = "Demonstrated rate at 100%"
+
+EBIT_HEADERS = [
+    "Quoted Cost/pc",
+    "Actual OEE cost/pc at Plex cost/hr (quote)",
+    "Plex Standard Cost/pc",
+    "Actual OEE cost/pc at Plex cost/hr (plex)",
+]
+EBIT_LABELS = ["OH $", "LAB $", "Var OH Total", "Labor Total"]
+
+# Below SCAN_MAX_ROWS (150) but within SCAN_EBIT_MAX_ROWS (500)
+LATE_EBIT_ROW = 300
+# EBIT block placement per workbook in generate_tree, cycled
+EBIT_VARIANTS = ('template', 'none', LATE_EBIT_ROW)
+
+
+def generate_workbook(path, plant=None, part_name=None, rows_per_category=4,
+                      extra_rows=0, extra_cols=0, noise=0.1, seed=0, ebit='template'):
+    """Write one synthetic SMITCH workbook to ``path``.
+
+    ``rows_per_category`` controls the subcategory block height,
+    ``extra_rows``/``extra_cols`` pad the sheet with unrelated numeric data
+    below/right of the template, and ``noise`` (0..1) is the share of
+    template value cells left blank or replaced by stray text. ``ebit`` puts
+    the EBIT block right below the categories ('template'), leaves it out
+    ('none') or starts its header row at the given row number.
+    """
+    from openpyxl import Workbook
+
+    rnd = random.Random(seed)
+    plant = plant or rnd.choice(sorted(KNOWN_PLANTS))
+    part_name = part_name or f"Part {rnd.randint(1000, 9999)} Assembly"
+    date = f"{rnd.randint(1, 12)}/{rnd.randint(1, 28)}/2025"
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "SMITCH"
+
+    # Title block
+    ws.cell(1, 1, "SMITCH Review")
+    ws.cell(1, 6, f"Plant: {plant}")
+    ws.cell(2, 2, part_name)
+    ws.cell(2, 10, "Weekly APW")
+    ws.cell(1, 12, "Quoted APW")
+    ws.cell(2, 12, f"{rnd.randint(500, 5000):,}")
+
+    # Metric header row (row 3) with dates, ending at the stop column
+    headers = [h.format(date=date) for h in METRIC_HEADERS] + [STOP_HEADER]
+    for i, header in enumerate(headers):
+        ws.cell(3, 3 + i, header)
+    metric_cols = range(3, 3 + len(headers))
+
+    def value():
+        r = rnd.random()
+        if r < noise / 2:
+            return None
+        if r < noise:
+            return rnd.choice(["n/a", "TBD", "-", "see note"])
+        return round(rnd.uniform(0, 1000), 2)
+
+    # Category blocks
+    row = 5
+    for letter, name in CATEGORIES:
+        ws.cell(row, 1, letter if rnd.random() < 0.5 else f"{letter}\n{name}")
+        ws.cell(row, 2, name)
+        for k in range(1, rows_per_category + 1):
+            ws.cell(row + k, 2, f"{name} item {k}")
+            for col in metric_cols:
+                ws.cell(row + k, col, value())
+        row += rows_per_category + 2
+
+    # EBIT block: metric headers, then OH/LAB rows below them
+    ebit_rows = range(0)
+    if ebit != 'none':
+        ebit_row = row + 2 if ebit == 'template' else ebit
+        ebit_rows = range(ebit_row - 1, ebit_row + len(EBIT_LABELS) + 2)
+        for i, header in enumerate(EBIT_HEADERS):
+            ws.cell(ebit_row, 5 + i, header)
+        for i, label in enumerate(EBIT_LABELS):
+            ws.cell(ebit_row + 1 + i, 4, label)
+            for j in range(len(EBIT_HEADERS)):
+                ws.cell(ebit_row + 1 + i, 5 + j, f"${rnd.uniform(0, 50):.2f}")
+
+    # Unrelated data around the template (columns A/B left empty so the
+    # last category block does not pick the filler up as subcategories;
+    # rows of an EBIT block placed further down are skipped)
+    filler_start = row + len(EBIT_LABELS) + 5
+    for r in range(filler_start, filler_start + extra_rows):
+        if r in ebit_rows:
+            continue
+        for c in range(3, 20):
+            ws.cell(r, c, rnd.random())
+    for c in range(30, 30 + extra_cols):
+        for r in range(1, 40):
+            ws.cell(r, c, rnd.random())
+
+    wb.save(path)
+    return path
+
+
+def generate_tree(root, n_files=20, extension_mix=('.xlsm', '.xlsx'), seed=0,
+                  ebit_variants=EBIT_VARIANTS, no_ebit_rows=None, **workbook_kwargs):
+    """Generate ``n_files`` workbooks under ``root/<region> <plant>/``; returns their paths.
+
+    EBIT placement cycles through ``ebit_variants`` (see generate_workbook);
+    workbooks without an EBIT block get ``no_ebit_rows`` filler rows instead
+    of ``extra_rows`` when given.
+    """
+    rnd = random.Random(seed)
+    plants = sorted(KNOWN_PLANTS)
+    paths = []
+    for i in range(n_files):
+        plant = plants[i % len(plants)]
+        folder = os.path.join(root, f"{'EU' if i % 2 else 'NA'} {plant}")
+        os.makedirs(folder, exist_ok=True)
+        ext = extension_mix[i % len(extension_mix)]
+        path = os.path.join(folder, f"SMITCH - synthetic {i:04d}{ext}")
+        ebit = ebit_variants[i % len(ebit_variants)]
+        kwargs = dict(workbook_kwargs)
+        if ebit == 'none' and no_ebit_rows is not None:
+            kwargs['extra_rows'] = no_ebit_rows
+        generate_workbook(path, plant=plant, seed=rnd.randint(0, 2 ** 31), ebit=ebit, **kwargs)
+        paths.append(path)
+    return paths
@@ -1,5 +1,7 @@
 import os
+import importlib.util
 import logging
+import re
 from typing import Dict, Any
 
 class Config:
@@ -11,6 +13,17 @@ class Config:
     OUTPUT_PATH = os.getenv('OUTPUT_PATH', r'C:\Users\RShrestha\OneDrive - Dura-Shiloh\smitch_extracted')
     LOG_PATH = os.getenv('LOG_PATH', './logs')
     
+    # Output formats, comma separated: 'xlsx', 'csv', 'jsonl' (one file per workbook),
+    # 'parquet' (Plant-partitioned dataset under PARQUET_PATH, needs pyarrow); 'both' = xlsx,parquet
+    OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'xlsx').lower()
+    OUTPUT_COMPRESSION = os.getenv('OUTPUT_COMPRESSION', 'none').lower()  # csv/jsonl codec: none, gzip, bz2 or xz
+    PARQUET_PATH = os.getenv('PARQUET_PATH', os.path.join(OUTPUT_PATH, 'parquet'))
+    SKIP_UNCHANGED_OUTPUT = os.getenv('SKIP_UNCHANGED_OUTPUT', 'true').lower() == 'true'  # don't rewrite outputs whose rows did not change
+    
+    # Processed-files manifest: 'sqlite' (default) or 'json' (legacy processed_files.json)
+    MANIFEST_BACKEND = os.getenv('MANIFEST_BACKEND', 'sqlite').lower()
+    MANIFEST_PATH = os.getenv('MANIFEST_PATH', os.path.join(LOG_PATH, 'processed_files.db'))
+    
     # SharePoint specific settings
     SHAREPOINT_MODE = os.getenv('SHAREPOINT_MODE', 'false').lower() == 'true'
     NETWORK_TIMEOUT = int(os.getenv('NETWORK_TIMEOUT', '30'))  # seconds
@@ -22,13 +35,48 @@ class Config:
     # UNC Path: "\\sharepoint.company.com\sites\team\Shared Documents\SMITCH"
     
     # Watcher settings
-    COOLDOWN_SECONDS = int(os.getenv('COOLDOWN_SECONDS', '10'))
+    DEBOUNCE_SECONDS = float(os.getenv('DEBOUNCE_SECONDS', '2'))  # quiet period per file before extracting
+    COOLDOWN_SECONDS = int(os.getenv('COOLDOWN_SECONDS', '10'))  # minimum gap between runs of the same file
+    WATCHER_WORKERS = int(os.getenv('WATCHER_WORKERS', '2'))  # files extracted concurrently by the watcher
+    STARTUP_SCAN = os.getenv('STARTUP_SCAN', 'true').lower() == 'true'  # queue files changed while the watcher was down
+    READY_WINDOW_SECONDS = float(os.getenv('READY_WINDOW_SECONDS', '2'))  # size/mtime must hold this long before extracting
+    READY_MAX_WAIT_SECONDS = float(os.getenv('READY_MAX_WAIT_SECONDS', '600'))  # give up on files that never complete
+    # 'native' = OS change notifications, 'polling' = incremental stat poller, 'auto' = polling when SHAREPOINT_MODE
+    OBSERVER_BACKEND = os.getenv('OBSERVER_BACKEND', 'auto').lower()
+    POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '5'))  # seconds between polling cycles
+    POLL_MAX_CPU = float(os.getenv('POLL_MAX_CPU', '0.1'))  # share of one core the poller may use
+    POLL_FULL_SCAN_EVERY = int(os.getenv('POLL_FULL_SCAN_EVERY', '12'))  # cycles between full re-listings (0 = never)
     TIMEOUT_SECONDS = int(os.getenv('TIMEOUT_SECONDS', '120'))
+    # 'inprocess' extracts on a warm worker thread; 'subprocess' runs test_runner.py per change (isolation)
+    EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'inprocess').lower()
     
     # File settings
     SUPPORTED_EXTENSIONS = ('.xlsm', '.xlsx')
     MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '100'))
     
+    # Extraction settings
+    # Streaming mode opens workbooks read-only and stops parsing once the
+    # detector scan window is filled (the EBIT block may extend it downward)
+    STREAMING_LOAD = os.getenv('STREAMING_LOAD', 'true').lower() == 'true'
+    SCAN_MAX_ROWS = int(os.getenv('SCAN_MAX_ROWS', '150'))
+    SCAN_MAX_COLS = int(os.getenv('SCAN_MAX_COLS', '64'))  # EBIT values run up to 14 columns past the OH anchor
+    # Past the window, rows are only checked for a late EBIT "OH" anchor, up to this row
+    SCAN_EBIT_MAX_ROWS = int(os.getenv('SCAN_EBIT_MAX_ROWS', '500'))
+    # Sheets extracted per workbook: 'active', 'all' (visible sheets) or a sheet-name regex;
+    # anything but 'active' adds a Sheet column to the output
+    EXTRACT_SHEETS = os.getenv('EXTRACT_SHEETS', 'active')
+    # Per-stage timing log (LOG_PATH/extraction_timing.jsonl); with a positive
+    # threshold, extractions also run under cProfile and slow ones are dumped
+    EXTRACTION_TIMING = os.getenv('EXTRACTION_TIMING', 'false').lower() == 'true'
+    PROFILE_THRESHOLD_SECONDS = float(os.getenv('PROFILE_THRESHOLD_SECONDS', '0'))
+    # Reuse detected layouts (metric columns, categories, EBIT anchor) across workbooks
+    # sharing a template; persisted in LAYOUT_CACHE_PATH and validated before each reuse.
+    # Off by default: detection is already a fraction of a millisecond per sheet
+    LAYOUT_CACHE = os.getenv('LAYOUT_CACHE', 'false').lower() == 'true'
+    LAYOUT_CACHE_PATH = os.getenv('LAYOUT_CACHE_PATH', os.path.join(LOG_PATH, 'layout_cache.db'))
+    # Batch extraction processes for test_runner.py (0 = one per CPU core)
+    EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '0')) or (os.cpu_count() or 1)
+    
     # Logging configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -43,6 +91,25 @@ class Config:
     EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD', '')
     NOTIFICATION_EMAILS = os.getenv('NOTIFICATION_EMAILS', '').split(',')
     
+    @classmethod
+    def output_formats(cls) -> tuple:
+        """OUTPUT_FORMAT as a tuple of formats, in order; 'both' stands for xlsx and parquet"""
+        formats = []
+        for fmt in cls.OUTPUT_FORMAT.split(','):
+            fmt = fmt.strip()
+            if fmt == 'both':
+                formats.extend(('xlsx', 'parquet'))
+            elif fmt:
+                formats.append(fmt)
+        return tuple(dict.fromkeys(formats))
+    
+    @classmethod
+    def observer_backend(cls) -> str:
+        """Resolve OBSERVER_BACKEND 'auto' to 'polling' (SharePoint mode) or 'native'"""
+        if cls.OBSERVER_BACKEND == 'auto':
+            return 'polling' if cls.SHAREPOINT_MODE else 'native'
+        return cls.OBSERVER_BACKEND
+    
     @classmethod
     def validate(cls) -> Dict[str, Any]:
         """Validate configuration and return status with SharePoint support"""
@@ -71,6 +138,24 @@ class Config:
             except Exception as e:
                 issues.append(f"Cannot create output path: {e}")
         
+        formats = cls.output_formats()
+        unknown = [fmt for fmt in formats if fmt not in ('xlsx', 'csv', 'jsonl', 'parquet')]
+        if unknown or not formats:
+            issues.append(f"Unknown OUTPUT_FORMAT: {cls.OUTPUT_FORMAT} (expected xlsx, csv, jsonl, parquet or both)")
+        elif 'parquet' in formats and importlib.util.find_spec('pyarrow') is None:
+            issues.append("OUTPUT_FORMAT includes parquet but pyarrow is not installed")
+        if cls.OUTPUT_COMPRESSION not in ('none', 'gzip', 'bz2', 'xz'):
+            issues.append(f"Unknown OUTPUT_COMPRESSION: {cls.OUTPUT_COMPRESSION} (expected none, gzip, bz2 or xz)")
+        
+        if cls.OBSERVER_BACKEND not in ('auto', 'native', 'polling'):
+            issues.append(f"Unknown OBSERVER_BACKEND: {cls.OBSERVER_BACKEND} (expected auto, native or polling)")
+        
+        if cls.EXTRACT_SHEETS.lower() not in ('active', 'all'):
+            try:
+                re.compile(cls.EXTRACT_SHEETS)
+            except re.error as e:
+                issues.append(f"EXTRACT_SHEETS is not 'active', 'all' or a valid sheet-name pattern: {e}")
+        
         # Create log path
         if not os.path.exists(cls.LOG_PATH):
             try:
@@ -87,9 +172,16 @@ class Config:
                 'watch_path': cls.WATCH_PATH,
                 'output_path': cls.OUTPUT_PATH,
                 'log_path': cls.LOG_PATH,
+                'output_format': cls.OUTPUT_FORMAT,
+                'output_compression': cls.OUTPUT_COMPRESSION,
+                'debounce': cls.DEBOUNCE_SECONDS,
                 'cooldown': cls.COOLDOWN_SECONDS,
+                'watcher_workers': cls.WATCHER_WORKERS,
                 'timeout': cls.TIMEOUT_SECONDS,
                 'sharepoint_mode': cls.SHAREPOINT_MODE,
+                'extraction_mode': cls.EXTRACTION_MODE,
+                'observer_backend': cls.observer_backend(),
+                'extract_sheets': cls.EXTRACT_SHEETS,
                 'network_timeout': cls.NETWORK_TIMEOUT
             }
         }
@@ -7,7 +7,15 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import subprocess
 import sys
+import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeout, wait
 from config import Config
+import test_runner
+from utils.file_utils import is_temp_file, newest_first, scan_workbooks
+from utils.logger import atomic_write_json
+from utils.poller import IncrementalPoller
+from utils.readiness import GONE, TIMED_OUT, WAIT, ReadinessTracker
+from utils.scheduler import DebouncedScheduler
 
 # Optional email imports
 try:
@@ -29,13 +37,93 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Outcomes of one extraction run, as counted in the watcher stats
+SUCCESS, UNCHANGED, FAILED = 'success', 'unchanged', 'failed'
+
+class ExtractionEngine:
+    """Long-lived in-process extraction worker.
+
+    Runs test_runner.extract_single for the changed file on a thread in this
+    process, whose imports (extractor, openpyxl, pandas) are already loaded,
+    instead of starting a fresh interpreter and walking the whole tree.
+    Each run gets its own thread, so the timeout covers the extraction only.
+    A thread cannot be killed: a run that times out keeps going in the
+    background, and its path stays busy() until it really finishes.
+    """
+
+    def __init__(self, timeout=None, workers=1):
+        self.timeout = timeout or Config.TIMEOUT_SECONDS
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._running = {}      # path -> Future of its extraction
+        self._timed_out = set()  # paths whose run outlived the timeout and is still going
+        # Load the heavy imports now so the first event does not pay for them
+        import openpyxl  # noqa: F401
+        import pandas  # noqa: F401
+
+    def busy(self, path):
+        """True while an extraction of ``path`` is still running"""
+        with self._lock:
+            return path in self._running
+
+    def stuck(self):
+        """Number of timed-out extractions still holding a thread"""
+        with self._lock:
+            return len(self._timed_out)
+
+    def extract(self, path):
+        """Extract a single workbook; returns (status, message) from test_runner.extract_single.
+
+        Raises FuturesTimeout after ``timeout`` seconds.
+        """
+        future = Future()
+        with self._lock:
+            self._running[path] = future
+
+        def run():
+            try:
+                future.set_result(test_runner.extract_single(path))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running.pop(path, None)
+                    self._timed_out.discard(path)
+
+        threading.Thread(target=run, name='smitch-extract', daemon=True).start()
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            with self._lock:
+                if path in self._running:
+                    self._timed_out.add(path)
+            raise
+
+    def shutdown(self):
+        """Wait for extractions still within their timeout; timed-out ones are abandoned"""
+        with self._lock:
+            pending = [f for path, f in self._running.items() if path not in self._timed_out]
+        wait(pending, timeout=self.timeout)
+
+
 class ProductionSMITCHHandler(FileSystemEventHandler):
-    def __init__(self):
-        self.last_run = 0
-        self.cooldown = Config.COOLDOWN_SECONDS
+    def __init__(self, engine=None):
+        self.engine = engine
+        # Events only enqueue; extraction runs on the scheduler's worker threads
+        self.scheduler = DebouncedScheduler(
+            self.process_file,
+            debounce=Config.DEBOUNCE_SECONDS,
+            min_interval=Config.COOLDOWN_SECONDS,
+            workers=Config.WATCHER_WORKERS,
+        )
+        self.readiness = ReadinessTracker(
+            window=Config.READY_WINDOW_SECONDS, max_wait=Config.READY_MAX_WAIT_SECONDS
+        )
+        self.stats_lock = threading.Lock()
         self.stats = {
             'total_processed': 0,
             'successful_runs': 0,
+            'unchanged_runs': 0,
             'failed_runs': 0,
             'last_run_time': None,
             'uptime_start': datetime.now()
@@ -49,6 +137,9 @@ class ProductionSMITCHHandler(FileSystemEventHandler):
             if os.path.exists(stats_file):
                 with open(stats_file, 'r') as f:
                     saved_stats = json.load(f)
+                    saved_stats.pop('queue', None)
+                    # Uptime is measured from this process's start, not the previous run's
+                    saved_stats.pop('uptime_start', None)
                     self.stats.update(saved_stats)
                     # Convert string back to datetime
                     if self.stats['last_run_time']:
@@ -66,8 +157,10 @@ class ProductionSMITCHHandler(FileSystemEventHandler):
                 stats_to_save['last_run_time'] = stats_to_save['last_run_time'].isoformat()
             stats_to_save['uptime_start'] = stats_to_save['uptime_start'].isoformat()
             
-            with open(stats_file, 'w') as f:
-                json.dump(stats_to_save, f, indent=2)
+            stats_to_save['queue'] = self.scheduler.stats()
+            
+            # A stop mid-write must not leave a torn stats file behind
+            atomic_write_json(stats_to_save, stats_file, indent=2)
         except Exception as e:
             logger.error(f"Could not save stats: {e}")
     
@@ -95,84 +188,202 @@ class ProductionSMITCHHandler(FileSystemEventHandler):
         except Exception as e:
             logger.error(f"Failed to send notification: {e}")
     
-    def on_modified(self, event):
-        if not event.is_directory and event.src_path.endswith(Config.SUPPORTED_EXTENSIONS):
-            current_time = time.time()
-            if current_time - self.last_run > self.cooldown:
-                file_name = os.path.basename(event.src_path)
-                
-                # Wait a moment for file operations to complete
-                time.sleep(0.5)
-                
-                # Safely get file size with error handling
-                try:
-                    if not os.path.exists(event.src_path):
-                        logger.warning(f"File no longer exists, skipping: {file_name}")
-                        return
-                    
-                    # Check if file is still being written to (try to open for writing)
-                    try:
-                        with open(event.src_path, 'r+b'):
-                            pass
-                    except PermissionError:
-                        logger.info(f"File is still being written, skipping: {file_name}")
-                        return
-                    
-                    file_size = os.path.getsize(event.src_path) / (1024 * 1024)  # MB
-                except (FileNotFoundError, OSError, PermissionError) as e:
-                    logger.warning(f"Cannot access file {file_name}: {e}")
-                    return
-                
-                logger.info(f"File changed: {file_name} ({file_size:.2f}MB)")
-                
-                # Check file size limit
-                if file_size > Config.MAX_FILE_SIZE_MB:
-                    logger.warning(f"File too large: {file_size:.2f}MB > {Config.MAX_FILE_SIZE_MB}MB")
-                    return
+    def run_in_process(self, file_path: str, file_name: str) -> str:
+        """Extract the changed file on the warm in-process engine; returns SUCCESS, UNCHANGED or FAILED"""
+        try:
+            logger.info(f"Starting extraction (in-process): {file_name}")
+            status, message = self.engine.extract(file_path)
+            
+            if status == 'failed':
+                error_msg = f"Extraction failed for {file_name}: {message}"
+                logger.error(error_msg)
+                self.send_notification("Extraction Failed", error_msg)
+                return FAILED
+            
+            if status == 'unchanged':
+                logger.info(f"Content unchanged, nothing extracted: {file_name}")
+                return UNCHANGED
+            
+            logger.info("Extraction completed successfully!")
+            logger.info(f"    {message}")
+            return SUCCESS
                 
-                self.stats['total_processed'] += 1
+        except FuturesTimeout:
+            error_msg = (f"Extraction timed out ({self.engine.timeout}s) for {file_name}; "
+                         f"it keeps running in the background and the file is not re-extracted until it ends")
+            logger.error(error_msg)
+            self.send_notification("Extraction Timeout", error_msg)
+            
+        except Exception as e:
+            error_msg = f"Error running extraction for {file_name}: {e}"
+            logger.error(error_msg)
+            self.send_notification("Extraction Error", error_msg)
+        return FAILED
+    
+    def run_subprocess(self, file_path: str, file_name: str) -> str:
+        """Extract the changed file in a separate interpreter (isolation fallback); returns SUCCESS, UNCHANGED or FAILED"""
+        try:
+            logger.info(f"Starting extraction process: {file_name}")
+            result = subprocess.run(
+                [sys.executable, "test_runner.py", "--file", file_path], 
+                capture_output=True, 
+                text=True, 
+                timeout=Config.TIMEOUT_SECONDS
+            )
+            
+            if result.returncode == test_runner.EXIT_UNCHANGED:
+                logger.info(f"Content unchanged, nothing extracted: {file_name}")
+                return UNCHANGED
+            
+            if result.returncode == 0:
+                logger.info("Extraction completed successfully!")
                 
-                try:
-                    logger.info("Starting extraction process...")
-                    result = subprocess.run(
-                        [sys.executable, "test_runner.py"], 
-                        capture_output=True, 
-                        text=True, 
-                        timeout=Config.TIMEOUT_SECONDS
-                    )
-                    
-                    if result.returncode == 0:
-                        self.stats['successful_runs'] += 1
-                        self.stats['last_run_time'] = datetime.now()
-                        
-                        logger.info("Extraction completed successfully!")
-                        
-                        # Log output summary
-                        output_lines = result.stdout.strip().split('\n')
-                        for line in output_lines[-3:]:
-                            if line.strip():
-                                logger.info(f"    {line}")
-                    else:
-                        self.stats['failed_runs'] += 1
-                        error_msg = f"Extraction failed for {file_name}: {result.stderr}"
-                        logger.error(error_msg)
-                        self.send_notification("Extraction Failed", error_msg)
-                        
-                except subprocess.TimeoutExpired:
-                    self.stats['failed_runs'] += 1
-                    error_msg = f"Extraction timed out ({Config.TIMEOUT_SECONDS}s) for {file_name}"
-                    logger.error(error_msg)
-                    self.send_notification("Extraction Timeout", error_msg)
-                    
-                except Exception as e:
-                    self.stats['failed_runs'] += 1
-                    error_msg = f"Error running extraction for {file_name}: {e}"
-                    logger.error(error_msg)
-                    self.send_notification("Extraction Error", error_msg)
+                # Log output summary
+                output_lines = result.stdout.strip().split('\n')
+                for line in output_lines[-3:]:
+                    if line.strip():
+                        logger.info(f"    {line}")
+                return SUCCESS
+            
+            error_msg = f"Extraction failed for {file_name}: {result.stderr or result.stdout}"
+            logger.error(error_msg)
+            self.send_notification("Extraction Failed", error_msg)
                 
-                self.last_run = current_time
-                self.save_stats()
-                logger.info("Watching for more changes...")
+        except subprocess.TimeoutExpired:
+            error_msg = f"Extraction timed out ({Config.TIMEOUT_SECONDS}s) for {file_name}"
+            logger.error(error_msg)
+            self.send_notification("Extraction Timeout", error_msg)
+            
+        except Exception as e:
+            error_msg = f"Error running extraction for {file_name}: {e}"
+            logger.error(error_msg)
+            self.send_notification("Extraction Error", error_msg)
+        return FAILED
+    
+    def on_modified(self, event):
+        self.enqueue(event.src_path, event.is_directory)
+    
+    def on_created(self, event):
+        self.enqueue(event.src_path, event.is_directory)
+    
+    def on_moved(self, event):
+        # Excel and OneDrive save by writing a temp file and renaming it over the workbook
+        self.enqueue(event.dest_path, event.is_directory)
+    
+    def reconcile(self, root: str = None) -> int:
+        """Queue every workbook under ``root`` that the manifest says is stale.
+
+        Files changed while the watcher was down never raise an event, so on
+        startup the tree is listed once (scandir, stat from the same pass),
+        sorted newest first and diffed against the manifest; only stale files
+        are queued, without the debounce delay. Returns the number queued.
+        """
+        root = root or Config.WATCH_PATH
+        manifest = test_runner.get_manifest()
+        queued = 0
+        for path, st in newest_first(scan_workbooks(root, Config.SUPPORTED_EXTENSIONS)):
+            try:
+                needed, _ = manifest.needs_extraction(path, st)
+            except OSError as e:
+                logger.warning(f"Cannot check {os.path.basename(path)}: {e}")
+                continue
+            if needed:
+                self.scheduler.submit(path, delay=0)
+                queued += 1
+        return queued
+    
+    def enqueue(self, path: str, is_directory: bool = False):
+        """Hand a workbook event to the debounced queue (never blocks the observer thread)"""
+        if (not is_directory and path.endswith(Config.SUPPORTED_EXTENSIONS)
+                and not is_temp_file(os.path.basename(path))):
+            self.scheduler.submit(path)
+    
+    def process_file(self, file_path: str):
+        """Validate and extract one workbook; runs on a scheduler worker thread"""
+        file_name = os.path.basename(file_path)
+        
+        # A timed-out run of this file may still be writing its outputs; never race it
+        if self.engine is not None and self.engine.busy(file_path):
+            logger.warning(f"Previous extraction still running, re-checking in {Config.DEBOUNCE_SECONDS}s: {file_name}")
+            self.scheduler.defer(file_path, Config.DEBOUNCE_SECONDS)
+            return
+        
+        # Only extract once size/mtime are stable and the zip is complete;
+        # otherwise give the worker back and look again after the window
+        readiness = self.readiness.check(file_path)
+        if readiness == GONE:
+            logger.warning(f"File no longer exists, skipping: {file_name}")
+            return
+        if readiness == WAIT:
+            logger.debug(f"File not stable yet, re-checking in {Config.READY_WINDOW_SECONDS}s: {file_name}")
+            self.scheduler.defer(file_path, Config.READY_WINDOW_SECONDS)
+            return
+        if readiness == TIMED_OUT:
+            logger.warning(f"File did not become a complete workbook within "
+                           f"{Config.READY_MAX_WAIT_SECONDS}s, skipping: {file_name}")
+            return
+        
+        # Safely get file size with error handling
+        try:
+            file_size = os.path.getsize(file_path) / (1024 * 1024)  # MB
+        except (FileNotFoundError, OSError, PermissionError) as e:
+            logger.warning(f"Cannot access file {file_name}: {e}")
+            return
+        
+        logger.info(f"File changed: {file_name} ({file_size:.2f}MB)")
+        
+        # Check file size limit
+        if file_size > Config.MAX_FILE_SIZE_MB:
+            logger.warning(f"File too large: {file_size:.2f}MB > {Config.MAX_FILE_SIZE_MB}MB")
+            return
+        
+        with self.stats_lock:
+            self.stats['total_processed'] += 1
+        
+        if self.engine is not None and self.engine.stuck() < self.engine.workers:
+            outcome = self.run_in_process(file_path, file_name)
+        else:
+            if self.engine is not None:
+                logger.warning("Every in-process extraction thread is stuck past its timeout; "
+                               "using a killable subprocess")
+            outcome = self.run_subprocess(file_path, file_name)
+        
+        with self.stats_lock:
+            if outcome == SUCCESS:
+                self.stats['successful_runs'] += 1
+                self.stats['last_run_time'] = datetime.now()
+            elif outcome == UNCHANGED:
+                self.stats['unchanged_runs'] += 1
+            else:
+                self.stats['failed_runs'] += 1
+            self.save_stats()
+        logger.info("Watching for more changes...")
+
+def create_observer(event_handler):
+    """Native watchdog observer, or the incremental poller for synced folders"""
+    backend = Config.observer_backend()
+    if backend == 'polling':
+        logger.info(f"Observer: polling every {Config.POLL_INTERVAL}s "
+                    f"(CPU cap {Config.POLL_MAX_CPU:.0%}, full scan every {Config.POLL_FULL_SCAN_EVERY} cycles)")
+        return IncrementalPoller(
+            Config.WATCH_PATH, event_handler.enqueue, interval=Config.POLL_INTERVAL,
+            max_cpu=Config.POLL_MAX_CPU, full_scan_every=Config.POLL_FULL_SCAN_EVERY,
+            extensions=Config.SUPPORTED_EXTENSIONS,
+        )
+    logger.info("Observer: native file system events")
+    observer = Observer()
+    observer.schedule(event_handler, Config.WATCH_PATH, recursive=True)
+    return observer
+
+def startup_scan(event_handler):
+    """Run the startup reconciliation pass and log how much was behind"""
+    start = time.time()
+    try:
+        queued = event_handler.reconcile()
+    except Exception as e:
+        logger.error(f"Startup scan failed: {e}")
+        return
+    logger.info(f"Startup scan: {queued} stale file(s) queued in {time.time() - start:.2f}s")
 
 def health_check():
     """Perform system health check"""
@@ -188,8 +399,7 @@ def health_check():
     
     # Save health check results
     health_file = os.path.join(Config.LOG_PATH, 'health_check.json')
-    with open(health_file, 'w') as f:
-        json.dump(health_info, f, indent=2)
+    atomic_write_json(health_info, health_file, indent=2)
     
     return health_info
 
@@ -217,19 +427,27 @@ def main():
     
     logger.info(f"Monitoring: {Config.WATCH_PATH}")
     logger.info(f"Output: {Config.OUTPUT_PATH}")
-    logger.info(f"Cooldown: {Config.COOLDOWN_SECONDS}s")
+    logger.info(f"Debounce: {Config.DEBOUNCE_SECONDS}s (per-file cooldown: {Config.COOLDOWN_SECONDS}s)")
+    logger.info(f"Workers: {Config.WATCHER_WORKERS}")
     logger.info(f"Timeout: {Config.TIMEOUT_SECONDS}s")
     
+    logger.info(f"Extraction mode: {Config.EXTRACTION_MODE}")
+    
     if Config.SHAREPOINT_MODE:
         logger.info(f"SharePoint mode enabled (timeout: {Config.NETWORK_TIMEOUT}s)")
     
-    event_handler = ProductionSMITCHHandler()
-    observer = Observer()
-    observer.schedule(event_handler, Config.WATCH_PATH, recursive=True)
+    engine = ExtractionEngine(workers=Config.WATCHER_WORKERS) if Config.EXTRACTION_MODE == 'inprocess' else None
+    event_handler = ProductionSMITCHHandler(engine=engine)
+    event_handler.scheduler.start()
+    observer = create_observer(event_handler)
     
     observer.start()
     logger.info("File watcher started successfully")
     
+    if Config.STARTUP_SCAN:
+        # Started after the observer so nothing changed during the scan is missed
+        threading.Thread(target=startup_scan, args=(event_handler,), name='smitch-startup-scan', daemon=True).start()
+    
     try:
         last_health_check = time.time()
         
@@ -243,10 +461,17 @@ def main():
                 
                 # Log statistics
                 uptime = datetime.now() - event_handler.stats['uptime_start']
+                queue_stats = event_handler.scheduler.stats()
                 logger.info(f"Stats - Processed: {event_handler.stats['total_processed']}, "
                           f"Success: {event_handler.stats['successful_runs']}, "
+                          f"Unchanged: {event_handler.stats['unchanged_runs']}, "
                           f"Failed: {event_handler.stats['failed_runs']}, "
                           f"Uptime: {uptime}")
+                logger.info(f"Queue - Depth: {queue_stats['queue_depth']}, "
+                          f"In progress: {queue_stats['in_progress']}, "
+                          f"Coalesced: {queue_stats['coalesced']}, "
+                          f"Avg wait: {queue_stats['avg_wait']:.2f}s, "
+                          f"Max wait: {queue_stats['max_wait']:.2f}s")
                 
     except KeyboardInterrupt:
         logger.info("Shutdown signal received")
@@ -257,6 +482,10 @@ def main():
         observer.stop()
         logger.info("Stopping file watcher...")
         observer.join()
+        event_handler.scheduler.stop()
+        if engine is not None:
+            engine.shutdown()
+        test_runner.close_manifest()
         logger.info("Auto-watcher stopped gracefully")
     
     return 0
@@ -1,53 +1,266 @@
 import os
 import sys
-import re
+import argparse
+import threading
 
 # Add root to path for module discovery
 sys.path.append(os.path.dirname(__file__))
 
 from config import Config
-from utils.logger import load_processed_log, update_log
-from utils.file_utils import get_file_metadata
+from utils.manifest import open_manifest, with_content_hash
 from utils.extractor import extract_smitch_data_from_path
-from utils.saver import save_to_excel
-
-# Use configuration paths instead of hardcoded ones
-centralized_folder = Config.WATCH_PATH
-extracted_folder = Config.OUTPUT_PATH
-os.makedirs(extracted_folder, exist_ok=True)
-
-print(f"Processing files from: {centralized_folder}")
-print(f"Saving extracted data to: {extracted_folder}")
-
-# Load previous log
-processed_log = load_processed_log()
-new_log = processed_log.copy()
-
-# Process files
-extracted_count = 0
-for root, _, files in os.walk(centralized_folder):
-    for file in files:
-        if file.endswith(".xlsm") or file.endswith(".xlsx"):
-            full_path = os.path.join(root, file)
-            metadata = get_file_metadata(full_path)
-
-            if full_path not in processed_log or processed_log[full_path] != metadata:
-                print(f"Processing: {file}")
+from utils.file_utils import newest_first, scan_workbooks
+from utils.saver import save_output, save_to_parquet
+
+# --file exit status when the workbook content had not changed (nothing extracted)
+EXIT_UNCHANGED = 3
+
+# One manifest per process, shared by the watcher's in-process workers
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = open_manifest()
+        return _manifest
+
+
+def close_manifest():
+    """Close the process-wide manifest (the JSON backend compacts a large journal)"""
+    global _manifest
+    with _manifest_lock:
+        if _manifest is not None:
+            _manifest.close()
+            _manifest = None
+
+
+def output_key_for(full_path, centralized_folder):
+    """Output name stem for a workbook; the subfolder is part of it to avoid collisions"""
+    root = os.path.dirname(full_path)
+    file = os.path.basename(full_path)
+    subfolder = os.path.relpath(root, centralized_folder).replace("\\", "_").replace("/", "_")
+    return f"{subfolder}_{os.path.splitext(file)[0]}"
+
+
+def output_path_for(full_path, centralized_folder, extracted_folder):
+    """Per-workbook output file, without the format's extension"""
+    return os.path.join(extracted_folder, f"{output_key_for(full_path, centralized_folder)}_extracted")
+
+
+def find_changed_files(centralized_folder, manifest):
+    """Return (full_path, state) for every workbook whose content or extractor changed, newest first"""
+    changed = []
+    for full_path, st in newest_first(scan_workbooks(centralized_folder)):
+        try:
+            needed, state = manifest.needs_extraction(full_path, st)
+        except OSError as e:
+            print(f"[!] Cannot read {os.path.basename(full_path)}: {e}")
+            continue
+        if needed:
+            changed.append((full_path, state))
+    return changed
+
+
+def output_fingerprint(records):
+    """Fingerprint of what would be written: the rows plus the output format (and codec)"""
+    if Config.OUTPUT_COMPRESSION != 'none':
+        return f"{Config.OUTPUT_FORMAT}:{Config.OUTPUT_COMPRESSION}:{records.fingerprint()}"
+    return f"{Config.OUTPUT_FORMAT}:{records.fingerprint()}"
+
+
+def process_file(full_path, centralized_folder, extracted_folder, previous=None, state=None):
+    """Extract and save a single workbook.
+
+    Never raises, so one bad file cannot take down a worker pool.
+    Returns (status, message, output_path, state) with status one of
+    'saved', 'kept', 'empty', 'failed'. Outputs follow Config.OUTPUT_FORMAT
+    (xlsx, csv, jsonl, parquet; output_path is the first one written).
+    ``previous`` is the file's manifest entry; when the
+    extracted rows match its fingerprint and its output still exists, nothing
+    is written ('kept'), so unchanged outputs do not trigger a sync upload.
+    ``state`` is the manifest state from needs_extraction; for 'saved' and
+    'kept' it is returned with the content hash (computed here, in the
+    worker, if still missing) and the output fingerprint, ready to record.
+    """
+    file = os.path.basename(full_path)
+    try:
+        state = with_content_hash(full_path, state or {})
+        records = extract_smitch_data_from_path(full_path)
+        if not records:
+            return 'empty', f"[!] No data extracted from: {file}", None, None
+        state = dict(state, fingerprint=output_fingerprint(records))
+        if (Config.SKIP_UNCHANGED_OUTPUT and previous
+                and previous.get('output_fingerprint') == state['fingerprint']
+                and previous.get('output_path') and os.path.exists(previous['output_path'])):
+            return 'kept', f"Extracted rows unchanged, output kept: {file}", previous['output_path'], state
+        formats = Config.output_formats()
+        # One columnar frame per file, shared by the DataFrame-based formats;
+        # csv and jsonl stream straight from the record buffer
+        extracted_data = records.to_frame() if {'xlsx', 'parquet'} & set(formats) else records
+        output_path = None
+        for fmt in formats:
+            if fmt == 'parquet':
+                path = save_to_parquet(
+                    extracted_data, Config.PARQUET_PATH, output_key_for(full_path, centralized_folder)
+                )
+            else:
+                path = save_output(
+                    extracted_data if fmt == 'xlsx' else records, fmt,
+                    output_path_for(full_path, centralized_folder, extracted_folder), Config.OUTPUT_COMPRESSION
+                )
+            output_path = output_path or path
+        return 'saved', f"Processed: {file}", output_path, state
+    except Exception as e:
+        return 'failed', f"[X] Failed: {file} -> {str(e)}", None, None
+
+
+def extract_single(full_path, force=False):
+    """Extract one workbook if its content changed (or ``force``) and record it when saved"""
+    manifest = get_manifest()
+    needed, state = manifest.needs_extraction(full_path)
+    if not needed and not force:
+        return 'unchanged', f"Unchanged, skipped: {os.path.basename(full_path)}"
+    os.makedirs(Config.OUTPUT_PATH, exist_ok=True)
+    status, message, output_path, state = process_file(
+        full_path, Config.WATCH_PATH, Config.OUTPUT_PATH, previous=manifest.get(full_path), state=state
+    )
+    if status in ('saved', 'kept'):
+        manifest.record(full_path, state, output_path)
+    return status, message
+
+
+def process_file_isolated(args):
+    """process_file(*args) in a worker process of its own; a crash fails only this file"""
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(process_file, *args).result()
+        except BrokenProcessPool:
+            return 'failed', f"[X] Failed: {os.path.basename(args[0])} -> worker process died", None, None
+        except Exception as e:
+            return 'failed', f"[X] Failed: {os.path.basename(args[0])} -> {str(e)}", None, None
+
+
+def run(workers=1):
+    # Use configuration paths instead of hardcoded ones
+    centralized_folder = Config.WATCH_PATH
+    extracted_folder = Config.OUTPUT_PATH
+    os.makedirs(extracted_folder, exist_ok=True)
+
+    print(f"Processing files from: {centralized_folder}")
+    print(f"Saving extracted data to: {extracted_folder}")
+
+    manifest = get_manifest()
+    changed = find_changed_files(centralized_folder, manifest)
+    state_by_path = dict(changed)
+    previous_by_path = {full_path: manifest.get(full_path) for full_path, _ in changed}
+    results = {}
+
+    if workers <= 1 or len(changed) <= 1:
+        for full_path, _ in changed:
+            print(f"Processing: {os.path.basename(full_path)}")
+            status, message, output_path, state = process_file(
+                full_path, centralized_folder, extracted_folder, previous_by_path[full_path], state_by_path[full_path]
+            )
+            if status != 'saved':
+                print(message)
+            results[full_path] = (status, output_path, state)
+    else:
+        # Imported here: single-file runs spawned by the watcher never need a pool
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from concurrent.futures.process import BrokenProcessPool
+        workers = min(workers, len(changed))
+        print(f"Processing {len(changed)} file(s) with {workers} workers")
+        retry = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(
+                    process_file, full_path, centralized_folder, extracted_folder,
+                    previous_by_path[full_path], state_by_path[full_path]
+                ): full_path
+                for full_path, _ in changed
+            }
+            for future in as_completed(futures):
+                full_path = futures[future]
                 try:
-                    extracted_data = extract_smitch_data_from_path(full_path)
-                    if extracted_data:
-                        # Include subfolder name in output file name to avoid collisions
-                        subfolder = os.path.relpath(root, centralized_folder).replace("\\", "_").replace("/", "_")
-                        output_filename = f"{subfolder}_{os.path.splitext(file)[0]}_extracted.xlsx"
-                        output_path = os.path.join(extracted_folder, output_filename)
-                        save_to_excel(extracted_data, output_path)
-                        new_log[full_path] = metadata
-                        extracted_count += 1
-                    else:
-                        print(f"[!] No data extracted from: {file}")
+                    status, message, output_path, state = future.result()
+                except BrokenProcessPool:
+                    # A worker died (e.g. out of memory) and took the pool down; every
+                    # unfinished file lands here, not only the one that crashed it
+                    retry.append(full_path)
+                    continue
                 except Exception as e:
-                    print(f"[X] Failed: {file} -> {str(e)}")
+                    status, message, output_path, state = (
+                        'failed', f"[X] Failed: {os.path.basename(full_path)} -> {str(e)}", None, None
+                    )
+                print(message)
+                results[full_path] = (status, output_path, state)
+
+        if retry:
+            # One process per file, so a file that crashes again fails alone
+            from concurrent.futures import ThreadPoolExecutor
+            print(f"[!] A worker process died; retrying {len(retry)} unfinished file(s) in separate processes")
+            retry.sort()
+            jobs = [
+                (full_path, centralized_folder, extracted_folder, previous_by_path[full_path], state_by_path[full_path])
+                for full_path in retry
+            ]
+            with ThreadPoolExecutor(max_workers=min(workers, len(retry))) as threads:
+                for full_path, result in zip(retry, threads.map(process_file_isolated, jobs)):
+                    status, message, output_path, state = result
+                    print(message)
+                    results[full_path] = (status, output_path, state)
+
+    # Merge in path order so the manifest is identical regardless of completion order
+    done = [
+        (full_path, state, output_path)
+        for full_path, (status, output_path, state) in sorted(results.items())
+        if status in ('saved', 'kept')
+    ]
+    manifest.record_many(done)
+    extracted_count = sum(1 for status, _, _ in results.values() if status == 'saved')
+    kept_count = len(done) - extracted_count
+    print(f"\nExtraction complete. {extracted_count} file(s) processed and saved in '{extracted_folder}'.")
+    if kept_count:
+        print(f"{kept_count} file(s) changed but produced identical rows; outputs left untouched.")
+    return extracted_count
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract S.M.I.T.C.H. data from changed workbooks")
+    parser.add_argument(
+        '--workers', type=int, default=Config.EXTRACT_WORKERS,
+        help="Number of extraction processes (default: EXTRACT_WORKERS or CPU count; 1 = in-process)"
+    )
+    parser.add_argument(
+        '--file', dest='file_path',
+        help="Extract only this workbook (used by the watcher's subprocess mode; exit status 3 if unchanged)"
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help="With --file, extract even if the workbook content is unchanged"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.file_path:
+            status, message = extract_single(os.path.abspath(args.file_path), force=args.force)
+            print(message)
+            if status == 'failed':
+                return 1
+            return EXIT_UNCHANGED if status == 'unchanged' else 0
+        run(workers=args.workers)
+        return 0
+    finally:
+        close_manifest()
+
 
-# Update log
-update_log(new_log)
-print(f"\nExtraction complete. {extracted_count} file(s) processed and saved in '{extracted_folder}'.")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Batch extraction over many workbooks.
+
+``iter_record_batches`` extracts a stream of paths into one RecordBuffer at
+a time and yields it as a columnar DataFrame once it holds ``batch_rows``
+rows, so memory stays bounded by the batch size rather than the tree.
+``extract_frame`` concatenates the batches into a single DataFrame with
+categorical label columns.
+"""
+
+from utils.extractor import extract_smitch_data_from_path
+from utils.records import CATEGORICAL_COLUMNS, SHEET_COLUMN, SOURCE_COLUMN, RecordBuffer
+
+DEFAULT_BATCH_ROWS = 100_000
+
+
+def iter_record_batches(paths, batch_rows=DEFAULT_BATCH_ROWS, categorical=True,
+                        source=None, on_error=None):
+    """Yield DataFrames of roughly ``batch_rows`` rows extracted from ``paths``.
+
+    ``source(path)`` gives the 'Source File' label for a workbook (default:
+    the path itself). Files that fail to extract are passed to
+    ``on_error(path, exc)`` and skipped; without a callback the error is raised.
+    A workbook's rows never span two batches.
+    """
+    records = RecordBuffer()
+    for path in paths:
+        start = len(records)
+        records.begin_source(source(path) if source else path)
+        try:
+            extract_smitch_data_from_path(path, out=records)
+        except Exception as e:
+            if on_error is None:
+                raise
+            records.truncate(start)
+            on_error(path, e)
+            continue
+        if len(records) >= batch_rows:
+            yield records.to_frame(categorical=categorical)
+            records = RecordBuffer()
+    if records:
+        yield records.to_frame(categorical=categorical)
+
+
+def extract_frame(paths, **kwargs):
+    """Extract every workbook in ``paths`` into one DataFrame (see iter_record_batches)"""
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    frames = list(iter_record_batches(paths, **kwargs))
+    if not frames:
+        return RecordBuffer().to_frame(categorical=kwargs.get('categorical', True))
+    if len(frames) == 1:
+        return frames[0]
+
+    # Batches have different category sets; union them so the result stays categorical
+    data = {}
+    for name in frames[0].columns:
+        if name in CATEGORICAL_COLUMNS or name in (SOURCE_COLUMN, SHEET_COLUMN):
+            if isinstance(frames[0][name].dtype, pd.CategoricalDtype):
+                data[name] = union_categoricals([f[name] for f in frames])
+                continue
+        data[name] = pd.concat([f[name] for f in frames], ignore_index=True)
+    return pd.DataFrame(data)
@@ -1,16 +1,28 @@
 
+import os
 import re
-from datetime import datetime
-
-# Optional Streamlit import for UI functionality
-try:
-    import streamlit as st
-except ImportError:
-    # Create a mock st object for command-line usage
-    class MockStreamlit:
-        def error(self, msg): print(f"ERROR: {msg}")
-        def warning(self, msg): print(f"WARNING: {msg}")
-    st = MockStreamlit()
+import sys
+from calendar import monthrange
+from collections import deque
+from functools import lru_cache
+
+from config import Config
+from utils.records import RecordBuffer
+from utils.sheet_snapshot import SheetSnapshot, as_snapshot
+from utils import profiling
+
+class MockStreamlit:
+    """Console stand-in for st.error/st.warning in command-line usage"""
+    def error(self, msg): print(f"ERROR: {msg}")
+    def warning(self, msg): print(f"WARNING: {msg}")
+
+_console = MockStreamlit()
+
+def _ui():
+    # Report through Streamlit only when a Streamlit app has already loaded it;
+    # importing it here would cost every command-line extraction its startup time
+    st = sys.modules.get('streamlit')
+    return st if st is not None else _console
 
 KNOWN_PLANTS = {
     "Bielsko Biala", "Birmingham", "Blatna", "Einbeck", "Forsheda",
@@ -18,26 +30,88 @@ KNOWN_PLANTS = {
     "Kalamazoo", "Saltillo", "Valley City", "Wellington"
 }
 
-def extract_weekly_apw(sheet, plant_name=None, part_name=None):
+# One case-insensitive alternation over all plant names (longest first)
+PLANT_PATTERN = re.compile(
+    "|".join(re.escape(p) for p in sorted(KNOWN_PLANTS, key=len, reverse=True)), re.IGNORECASE
+)
+_PLANT_BY_LOWER = {p.lower(): p for p in KNOWN_PLANTS}
+
+# detect_plant scans the title block first and only widens when nothing matched.
+# With STREAMING_LOAD the sheet is only read to SCAN_MAX_ROWS x SCAN_MAX_COLS
+# (150 x 64 by default), so a plant name below or right of that is not seen
+# and the plant comes from the folder name instead.
+PLANT_SEARCH_WINDOWS = [(20, 30), (100, 64)]
+
+# extract_ebit_metrics looks for the OH anchor in columns 1..49
+EBIT_OH_SEARCH_COLS = 50
+# EBIT value cells take their metric from the nearest header at most this many rows above
+EBIT_HEADER_LOOKBACK = 29
+EBIT_METRIC_MAP = {
+    "quoted cost/pc": "Quoted_Cost",
+    "actual oee cost/pc at plex cost/hr (quote)": "Actual_OEE",
+    "plex standard cost/pc": "Plex_Cost",
+    "actual oee cost/pc at plex cost/hr (plex)": "Plex_OEE"
+}
+
+# Metric header normalization for extract_smitch_data; first key contained in the header wins
+METRIC_NORMALIZATION = {
+    "quoted cost model": "Quoted",
+    "quoted": "Quoted",
+    "plex standard": "Plex",
+    "plex": "Plex",
+    "actual performance": "Actual",
+    "actual": "Actual",
+    "forecasted cost": "Forecasted",
+    "forecasted": "Forecasted",
+    "demonstrated rate": "Demonstrated",
+    "demon-strated": "Demonstrated",
+}
+HEADER_CLEAN_PATTERN = re.compile(r'[^a-z\s$\/→-]')
+
+# Subcategory-column labels that mark a category header row rather than a subcategory,
+# including multi-line category formats like "S\nSales Price", "M\nMaterial", etc.
+FULL_CATEGORY_NAMES = frozenset({'Sales Price', 'Material', 'Investment', 'Tooling', 'Cycle Times', 'Headcount'})
+CATEGORY_MULTILINE_PATTERNS = frozenset({
+    'M\nMaterial', 'S\nSales Price', 'H\nHeadcount',
+    'C\nCycle Time(s)\n(in JPH)', 'C\nCycle Times', 'C\nCycle Time(s)',
+    'I\nInvestment', 'T\nTooling'
+})
+CATEGORY_HEADER_LABELS = FULL_CATEGORY_NAMES | CATEGORY_MULTILINE_PATTERNS
+
+# Layout detection windows: category letters in rows 1..49 of columns 1..3,
+# subcategory column scoring over rows 1..29
+CATEGORY_MAP = {
+    'S': 'Sales Price', 'M': 'Material', 'I': 'Investment',
+    'T': 'Tooling', 'C': 'Cycle Times', 'H': 'Headcount'
+}
+CATEGORY_SEARCH_ROWS = 49
+CATEGORY_SEARCH_COLS = 3
+SUBCATEGORY_SEARCH_ROWS = 29
+CATEGORY_MARKERS = frozenset(letter for key in CATEGORY_MAP for letter in (key, key.lower()))
+
+# Header dates: MM/DD/YYYY (or MM-DD-YYYY) and YYYY/MM/DD (or YYYY-MM-DD)
+DATE_MDY_PATTERN = re.compile(r"\b(\d{1,2})([/-])(\d{1,2})([/-])(\d{4})\b")
+DATE_YMD_PATTERN = re.compile(r"\b(\d{4})([/-])(\d{1,2})([/-])(\d{1,2})\b")
+# Header texts repeat across workbooks from the same template, so parsed dates are memoized
+DATE_CACHE_SIZE = 4096
+
+def extract_weekly_apw(sheet, plant_name=None, part_name=None, out=None):
+    records = RecordBuffer() if out is None else out
+    sheet = as_snapshot(sheet)
     for row in range(1, 21):  
         for col in range(1, 31): 
-            cell = sheet.cell(row=row, column=col).value
-            if isinstance(cell, str) and "WEEKLY APW" in cell.upper():
+            cell = sheet.text(row, col)
+            if cell is not None and "WEEKLY APW" in cell.upper():
                 # Look for numeric value to the right
                 for value_col in range(col + 1, min(col + 10, sheet.max_column + 1)):
-                    val = sheet.cell(row=row, column=value_col).value
+                    val = sheet.value(row, value_col)
                     numeric_value = extract_numeric_value(val)
                     if numeric_value is not None:
                         metric_name = find_apw_metric_context(sheet, row, value_col)
-                        return [{
-                            "Category": "EBIT LOSS",
-                            "Subcategory": "Weekly APW",
-                            "Metric": metric_name,
-                            "Value": numeric_value,
-                            "Plant": plant_name,
-                            "Part Name": part_name
-                        }]
-    return []
+                        records.append("EBIT LOSS", "Weekly APW", None, metric_name,
+                                       numeric_value, plant_name, part_name)
+                        return records
+    return records
 
 def extract_numeric_value(val):
     if isinstance(val, (int, float)):
@@ -55,8 +129,8 @@ def find_apw_metric_context(sheet, row, col):
     for dr, dc in offsets:
         r, c = row + dr, col + dc
         if r >= 1 and c >= 1:
-            val = sheet.cell(row=r, column=c).value
-            if isinstance(val, str) and len(val.strip()) > 2:
+            val = sheet.text(r, c)
+            if val is not None and len(val.strip()) > 2:
                 text = val.strip().replace('\n', ' ').title()
                 if any(word in text.lower() for word in ["quoted", "plex", "actual"]):
                     return text
@@ -74,6 +148,7 @@ def detect_metric_columns(sheet, stop_at_keywords=None):
     stop_column_found = None
 
     try:
+        sheet = as_snapshot(sheet)
         for search_row in range(1, min(6, sheet.max_row + 1)):
             temp_cols = []
             temp_headers = {}
@@ -81,8 +156,8 @@ def detect_metric_columns(sheet, stop_at_keywords=None):
 
             for col in range(3, min(sheet.max_column + 1, 20)):
                 try:
-                    cell = sheet.cell(row=search_row, column=col).value
-                    if cell and isinstance(cell, str) and len(cell.strip()) > 1:
+                    cell = sheet.text(search_row, col)
+                    if cell and len(cell.strip()) > 1:
                         header_clean = ' '.join(str(cell).strip().split()).lower()
                         temp_headers[col] = header_clean
                         temp_cols.append(col)
@@ -117,61 +192,123 @@ def detect_metric_columns(sheet, stop_at_keywords=None):
 
 def detect_categories(sheet):
     categories = []
-    category_map = {
-        'S': 'Sales Price', 'M': 'Material', 'I': 'Investment',
-        'T': 'Tooling', 'C': 'Cycle Times', 'H': 'Headcount'
-    }
 
     try:
-        for col in range(1, min(4, sheet.max_column + 1)):
-            for row in range(1, min(sheet.max_row + 1, 50)):
-                try:
-                    val = sheet.cell(row=row, column=col).value
-                    if not val:
-                        continue
-                    text = str(val).strip()
-                    lines = text.split('\n') if '\n' in text else [text]
-                    for line in lines:
-                        line_clean = line.strip().upper()
-                        if len(line_clean) == 1 and line_clean in category_map:
-                            if not any(c['letter'] == line_clean for c in categories):
-                                categories.append({
-                                    'row': row, 'column': col,
-                                    'letter': line_clean,
-                                    'name': category_map[line_clean]
-                                })
-                            break
-                except:
+        sheet = as_snapshot(sheet)
+        n_cols = min(CATEGORY_SEARCH_COLS, sheet.max_column)
+        window = list(zip(sheet.rows[:CATEGORY_SEARCH_ROWS], sheet.str_mask[:CATEGORY_SEARCH_ROWS]))
+        sheet.touch(len(window) * n_cols)
+
+        # First occurrence of each letter, scanning column by column
+        seen = set()
+        for col in range(n_cols):
+            for row_idx, (row, mask) in enumerate(window, start=1):
+                if not mask[col]:
                     continue
-        categories.sort(key=lambda x: x['row'])
+                letter = _marker_letter(row[col])
+                if letter and letter not in seen:
+                    seen.add(letter)
+                    categories.append({
+                        'row': row_idx, 'column': col + 1,
+                        'letter': letter,
+                        'name': CATEGORY_MAP[letter]
+                    })
+        categories.sort(key=lambda x: (x['row'], x['column']))
     except Exception as e:
-        st.error(f"Error detecting categories: {e}")
+        _ui().error(f"Error detecting categories: {e}")
         categories = []
 
     return categories
 
-def detect_plant(sheet):
-    for row in range(1, sheet.max_row + 1):
-        for col in range(1, sheet.max_column + 1):
-            val = sheet.cell(row=row, column=col).value
-            if val and isinstance(val, str):
-                text = val.strip()
-                for plant in KNOWN_PLANTS:
-                    if plant.lower() in text.lower():
-                        return plant, row
+def _marker_letter(text):
+    """Category letter a cell marks: the whole cell ("S") or a line of its own in a multi-line cell ("S\nSales Price")"""
+    stripped = text.strip()
+    if stripped in CATEGORY_MARKERS:
+        return stripped.upper()
+    return _category_letter(text) if '\n' in text else ''
+
+def _category_letter(text):
+    """Category letter on the first line of ``text`` that is one, else ''"""
+    for line in text.split('\n'):
+        line_clean = line.strip().upper()
+        if line_clean in CATEGORY_MAP:
+            return line_clean
+    return ''
+
+def label_code(text):
+    """How the category and subcategory detectors see a string cell.
+
+    The category letter it marks (if any) followed by 'L' for a category
+    description, 'T' for other text of two or more characters, '-' otherwise.
+    """
+    letter = _marker_letter(text)
+    stripped = text.strip()
+    if len(stripped) < 2:
+        return letter + '-'
+    return letter + ('L' if stripped in CATEGORY_HEADER_LABELS else 'T')
+
+def match_plant(text):
+    m = PLANT_PATTERN.search(text)
+    return _PLANT_BY_LOWER[m.group(0).lower()] if m else None
+
+def plant_from_path(file_path):
+    """Infer the plant from the folder layout (e.g. 'EU Blatna', 'NA Celaya')"""
+    folder = os.path.dirname(os.path.abspath(file_path))
+    watch_root = os.path.abspath(Config.WATCH_PATH)
+    try:
+        inside_watch = os.path.commonpath([folder, watch_root]) == watch_root
+    except ValueError:  # different drives
+        inside_watch = False
+    if not inside_watch:
+        return match_plant(os.path.basename(folder))
+
+    # Nearest folder first, stopping at the watch root
+    rel = os.path.relpath(folder, watch_root)
+    for name in reversed(rel.split(os.sep)):
+        plant = match_plant(name) if name != os.curdir else None
+        if plant:
+            return plant
+    return None
+
+def detect_plant(sheet, file_path=None):
+    if file_path:
+        plant = plant_from_path(file_path)
+        if plant:
+            return plant, None
+
+    sheet = as_snapshot(sheet)
+    prev_rows = prev_cols = 0
+    for max_rows, max_cols in PLANT_SEARCH_WINDOWS + [(sheet.max_row, sheet.max_column)]:
+        max_rows, max_cols = min(max_rows, sheet.max_row), min(max_cols, sheet.max_column)
+        for row in range(1, max_rows + 1):
+            # Skip the part of this row already covered by a smaller window
+            start = prev_cols if row <= prev_rows else 0
+            if start >= max_cols:
+                continue
+            row_values = sheet.rows[row - 1]
+            row_is_str = sheet.str_mask[row - 1]
+            sheet.touch(max_cols - start)
+            texts = [row_values[c] for c in range(start, max_cols) if row_is_str[c]]
+            if texts:
+                # One search per row; the leftmost match is the first matching cell
+                plant = match_plant("\n".join(texts))
+                if plant:
+                    return plant, row
+        prev_rows, prev_cols = max_rows, max_cols
     return None, None
 
 def detect_part_name(sheet, categories):
     try:
         if not categories:
             return None
+        sheet = as_snapshot(sheet)
         first_category_row = categories[0]['row']
         for row in range(first_category_row - 1, 0, -1):  # search upward
-            val = sheet.cell(row=row, column=2).value  
-            if val and isinstance(val, str):
+            val = sheet.text(row, 2)
+            if val:
                 val = val.strip()
-                # Return first non-empty text that isn't a single letter
-                if len(val) > 3 and val.upper() not in {'S', 'M', 'I', 'T', 'C', 'H'}:
+                # Nearest text above the first category that is longer than a category letter
+                if len(val) > 3:
                     return val
     except:
         pass
@@ -181,86 +318,70 @@ def detect_part_name(sheet, categories):
 def extract_date(text):
     if not isinstance(text, str):
         return None
-
-    # Enhanced regex to catch both MM/DD/YYYY and YYYY/MM/DD formats
-    date_patterns = [
-        (r"\b\d{1,2}[/-]\d{1,2}[/-]\d{4}\b", ["%m/%d/%Y", "%m-%d-%Y"]),  # MM/DD/YYYY or MM-DD-YYYY
-        (r"\b\d{4}[/-]\d{1,2}[/-]\d{1,2}\b", ["%Y/%m/%d", "%Y-%m-%d"]),  # YYYY/MM/DD or YYYY-MM-DD
-    ]
-    
-    for pattern, formats in date_patterns:
-        matches = re.findall(pattern, text)
-        for match in matches:
-            for date_format in formats:
-                try:
-                    dt = datetime.strptime(match, date_format)
-                    return dt.strftime("%Y-%m-%d")
-                except ValueError:
-                    continue
-    
-    # Legacy support for partial dates (keeping existing functionality)
-    matches = re.findall(r"\b\d{4}[/-]\d{1,2}(?:[/-]\d{1,2})?\b", text)
-    for match in matches:
-        try:
-            # if re.match(r"\d{1,2}/\d{4}$", match):  # MM/YYYY
-            #     dt = datetime.strptime(match, "%m/%Y")
-            # elif re.match(r"\d{1,2}/\d{2}$", match):  # MM/YY
-            #     dt = datetime.strptime(match, "%m/%y")
-            if re.match(r"\d{4}/\d{1,2}/\d{1,2}$", match):  # YYYY/MM/DD
-                dt = datetime.strptime(match, "%Y/%m/%d")
-            else:
-                continue
-            return dt.strftime("%Y-%m-%d")
-        except:
-            continue
+    return _parse_header_date(text)
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_header_date(text):
+    # MM/DD/YYYY or MM-DD-YYYY first, then YYYY/MM/DD or YYYY-MM-DD; the first valid match wins.
+    # Both separators must agree, as they did with the strptime formats this replaces.
+    for match in DATE_MDY_PATTERN.finditer(text):
+        month, sep1, day, sep2, year = match.groups()
+        if sep1 == sep2:
+            date_str = _format_date(int(year), int(month), int(day))
+            if date_str:
+                return date_str
+    for match in DATE_YMD_PATTERN.finditer(text):
+        year, sep1, month, sep2, day = match.groups()
+        if sep1 == sep2:
+            date_str = _format_date(int(year), int(month), int(day))
+            if date_str:
+                return date_str
     return None
 
+def _format_date(year, month, day):
+    """'YYYY-MM-DD', or None if the parts are not a real calendar date"""
+    if year < 1 or not 1 <= month <= 12 or not 1 <= day <= monthrange(year, month)[1]:
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
 
 
 def find_subcategory_column(sheet, categories):
     try:
         if not categories:
             return 3
+        sheet = as_snapshot(sheet)
         category_col = categories[0]['column']
         candidates = [category_col + 1, category_col + 2, category_col + 3, 3, 2]
-        
-        # Category description patterns to avoid
-        category_patterns = {
-            'M\nMaterial', 'S\nSales Price', 'H\nHeadcount', 
-            'C\nCycle Time(s)\n(in JPH)', 'C\nCycle Times', 'C\nCycle Time(s)',
-            'I\nInvestment', 'T\nTooling', 'Sales Price', 'Material', 
-            'Investment', 'Tooling', 'Cycle Times', 'Headcount'
-        }
-        
+        window = list(zip(sheet.rows[:SUBCATEGORY_SEARCH_ROWS], sheet.str_mask[:SUBCATEGORY_SEARCH_ROWS]))
+
         best_col = category_col + 1
         max_subcategory_score = 0
 
-        for col in candidates:
+        # A repeated candidate scores the same and cannot win on a strict '>'
+        for col in dict.fromkeys(candidates):
             if col < 1 or col > sheet.max_column:
                 continue
-            
+            sheet.touch(len(window))
+
             subcategory_score = 0
             category_description_count = 0
-            
-            for row in range(1, min(30, sheet.max_row + 1)):
-                cell = sheet.cell(row=row, column=col).value
-                if cell and isinstance(cell, str):
-                    cell_str = cell.strip()
+            for row, mask in window:
+                if mask[col - 1]:
+                    cell_str = row[col - 1].strip()
                     if len(cell_str) >= 2:
-                        # Check if this looks like a category description
-                        if cell_str in category_patterns:
+                        # Cells that look like category descriptions rather than subcategories
+                        if cell_str in CATEGORY_HEADER_LABELS:
                             category_description_count += 1
                         else:
-                            # This looks like a potential subcategory
                             subcategory_score += 1
-            
+
             # Prefer columns with more subcategories and fewer category descriptions
             final_score = subcategory_score - (category_description_count * 2)
-            
             if final_score > max_subcategory_score:
                 max_subcategory_score = final_score
                 best_col = col
-                
+
         return best_col
     except:
         return 3
@@ -369,95 +490,99 @@ def find_subcategory_column(sheet, categories):
 #             break
     
 #     return extracted
-def extract_ebit_metrics(sheet, plant_name=None, part_name=None, categories=None):
-    extracted = []
-    metric_map = {
-        "quoted cost/pc": "Quoted_Cost",
-        "actual oee cost/pc at plex cost/hr (quote)": "Actual_OEE",
-        "plex standard cost/pc": "Plex_Cost",
-        "actual oee cost/pc at plex cost/hr (plex)": "Plex_OEE"
-    }
-    allowed_metrics = set(metric_map.values())
+def classify_ebit_row(text):
+    """Map an EBIT label cell (OH $, LAB $, ... totals) to its subcategory, or None"""
+    val_clean = text.strip().upper()
+    if val_clean.startswith("OH") and ("$" in val_clean or val_clean == "OH"):
+        return "OH"
+    elif val_clean.startswith("LAB") and ("$" in val_clean or val_clean == "LAB"):
+        return "LAB"
+    elif "VAR OH TOTAL" in val_clean or "OH TOTAL" in val_clean:
+        return "OH Total"
+    elif "LABOR TOTAL" in val_clean or "LAB TOTAL" in val_clean:
+        return "LAB Total"
+    return None
 
-    ebit_col = None
-    start_row = None
-
-    # Step 1: Locate OH start row and EBIT column
-    for row in range(1, sheet.max_row + 1):
-        for col in range(1, min(sheet.max_column + 1, 50)):
-            val = sheet.cell(row=row, column=col).value
-            if isinstance(val, str) and val.strip().upper().startswith("OH"):
-                start_row = row
-                ebit_col = col
-                break
-        if ebit_col:
-            break
+def locate_ebit_anchor(sheet):
+    """(row, column) of the first "OH" cell in the EBIT search columns, or (None, None).
+
+    Only string cells are inspected; the string mask skips the rest of each row.
+    """
+    sheet = as_snapshot(sheet)
+    width = min(sheet.max_column, EBIT_OH_SEARCH_COLS - 1)
+    for row_idx, mask in enumerate(sheet.str_mask, start=1):
+        col = mask.find(1, 0, width)
+        while col != -1:
+            sheet.touch(1)
+            if sheet.rows[row_idx - 1][col].strip().upper().startswith("OH"):
+                return row_idx, col + 1
+            col = mask.find(1, col + 1, width)
+    return None, None
+
+def classify_ebit_header(header):
+    """EBIT metric named by a header cell, or None"""
+    lower = header.strip().lower()
+    for key, metric in EBIT_METRIC_MAP.items():
+        if key in lower:
+            return metric
+    return None
 
+def extract_ebit_metrics(sheet, plant_name=None, part_name=None, categories=None, out=None, anchor=None):
+    records = RecordBuffer() if out is None else out
+    sheet = as_snapshot(sheet)
+
+    # Step 1: Locate OH start row and EBIT column (unless already known from the layout)
+    start_row, ebit_col = anchor if anchor is not None else locate_ebit_anchor(sheet)
     if not ebit_col:
-        return extracted  # OH section not found
+        return records  # OH section not found
 
-    # Step 2: From OH down to LAB Total
-    for row in range(start_row, sheet.max_row + 1):
-        cell_val = sheet.cell(row=row, column=ebit_col).value
-        if not isinstance(cell_val, str):
-            continue
+    value_cols = range(ebit_col + 1, min(sheet.max_column + 1, ebit_col + 15))
+    # Per value column, the nearest metric header seen so far: column -> (row, metric).
+    # Rows are walked top-down once, so each header cell is classified a single time.
+    nearest_header = {}
 
-        val_clean = cell_val.strip().upper()
-        subcategory = None
-        if val_clean.startswith("OH") and ("$" in val_clean or val_clean == "OH"):
-            subcategory = "OH"
-        elif val_clean.startswith("LAB") and ("$" in val_clean or val_clean == "LAB"):
-            subcategory = "LAB"
-        elif "VAR OH TOTAL" in val_clean or "OH TOTAL" in val_clean:
-            subcategory = "OH Total"
-        elif "LABOR TOTAL" in val_clean or "LAB TOTAL" in val_clean:
-            subcategory = "LAB Total"
-        else:
-            continue  # Skip non-subcategory rows
-
-        # Stop after LAB Total
-        if subcategory == "LAB Total":
-            break
-
-        category = get_category_from_main(categories, row) if categories else "Unknown"
-        seen_metrics = set()
-
-        for c in range(ebit_col + 1, min(sheet.max_column + 1, ebit_col + 15)):
-            raw_val = sheet.cell(row=row, column=c).value
-            if raw_val is None:
-                continue
+    # Step 2: From OH down to LAB Total (starting early enough to see the headers above OH)
+    for row in range(max(1, start_row - EBIT_HEADER_LOOKBACK), sheet.max_row + 1):
+        if row >= start_row:
+            cell_val = sheet.text(row, ebit_col)
+            subcategory = classify_ebit_row(cell_val) if cell_val is not None else None
 
-            try:
-                value = float(str(raw_val).replace("$", "").replace(",", "").strip())
-            except:
-                continue
+            # Stop after LAB Total
+            if subcategory == "LAB Total":
+                break
 
-            # Search up for metric
-            metric = None
-            for rh in range(row - 1, max(0, row - 30), -1):
-                header = sheet.cell(row=rh, column=c).value
-                if isinstance(header, str):
-                    lower = header.strip().lower()
-                    for k, v in metric_map.items():
-                        if k in lower:
-                            metric = v
-                            break
-                    if metric:
-                        break
+            if subcategory is not None:
+                category = get_category_from_main(categories, row) if categories else "Unknown"
+                seen_metrics = set()
+
+                for c in value_cols:
+                    raw_val = sheet.value(row, c)
+                    if raw_val is None:
+                        continue
+
+                    try:
+                        value = float(str(raw_val).replace("$", "").replace(",", "").strip())
+                    except:
+                        continue
 
-            if metric and metric in allowed_metrics and metric not in seen_metrics:
-                extracted.append({
-                    "Category": category,
-                    "Subcategory": subcategory,
-                    "Metric": metric,
-                    "Value": value,
-                    "Plant": plant_name,
-                    "Part Name": part_name
-                })
-                seen_metrics.add(metric)
+                    # Metric header within the lookback window above this row
+                    header = nearest_header.get(c)
+                    if header is None or header[0] < row - EBIT_HEADER_LOOKBACK:
+                        continue
+                    metric = header[1]
+                    if metric not in seen_metrics:
+                        records.append(category, subcategory, None, metric, value, plant_name, part_name)
+                        seen_metrics.add(metric)
 
-    return extracted
+        # This row's headers apply to the rows below it
+        for c in value_cols:
+            header = sheet.text(row, c)
+            if header is not None:
+                metric = classify_ebit_header(header)
+                if metric:
+                    nearest_header[c] = (row, metric)
 
+    return records
 
 def get_category_from_main(categories, target_row):
 
@@ -473,140 +598,291 @@ def get_category_from_main(categories, target_row):
     
     return best_category['name'] if best_category else "Unknown"
 
-def extract_smitch_data(sheet, categories, metric_cols, headers, subcategory_col, plant_name=None, part_name=None):
-    extracted = []
+def classify_metric_header(header, col):
+    """Normalized metric name for a metric column header; None for columns that are skipped (CM%)"""
+    raw_header = header.strip().lower().split('\n')[0]
+    if "cm%" in raw_header:
+        return None
+
+    # Clean header for matching
+    cleaned_header = HEADER_CLEAN_PATTERN.sub('', raw_header).strip()
+
+    # Match against normalization dict
+    matched_key = next((k for k in METRIC_NORMALIZATION if k in cleaned_header), None)
+
+    if matched_key:
+        return METRIC_NORMALIZATION[matched_key]
+    elif "quoted jph" in cleaned_header:
+        return "Quoted_JPH"
+    elif "quoted $" in cleaned_header or "quoted $ / piece" in cleaned_header:
+        return "Quoted_$"
+    elif "actual jph" in cleaned_header:
+        return "Actual_JPH"
+    elif "actual $" in cleaned_header or "actual $ / piece" in cleaned_header:
+        return "Actual_$"
+    elif "plex std" in cleaned_header and "jph" in cleaned_header:
+        return "Plex_JPH"
+    elif "plex std" in cleaned_header and ("$" in cleaned_header or "piece" in cleaned_header):
+        return "Plex_$"
+    return raw_header.split()[0].capitalize() if raw_header else f"Col_{col}"
+
+def extract_smitch_data(sheet, categories, metric_cols, headers, subcategory_col, plant_name=None, part_name=None, out=None):
+    records = RecordBuffer() if out is None else out
 
     if not categories:
-        st.warning("No categories found")
-        return []
-
-    METRIC_NORMALIZATION = {
-        "quoted cost model": "Quoted",
-        "quoted": "Quoted",
-        "plex standard": "Plex",
-        "plex": "Plex",
-        "actual performance": "Actual",
-        "actual": "Actual",
-        "forecasted cost": "Forecasted",
-        "forecasted": "Forecasted",
-        "demonstrated rate": "Demonstrated",
-        "demon-strated": "Demonstrated",
-    }
+        _ui().warning("No categories found")
+        return records
+
+    sheet = as_snapshot(sheet)
 
     # Preprocess: Extract date from headers for each metric column
     col_date_map = {}
     for col in metric_cols:
         date_found = None
         for row in range(1, 6):
-            cell_val = sheet.cell(row=row, column=col).value
-            if isinstance(cell_val, str):
+            cell_val = sheet.text(row, col)
+            if cell_val is not None:
                 possible_date = extract_date(cell_val)
                 if possible_date:
                     date_found = possible_date
                     break
         col_date_map[col] = date_found
 
+    # Classify every metric column once: (0-based index, metric, date) per extracted column
+    column_plan = []
+    for col in metric_cols:
+        if not 0 < col <= sheet.max_column:
+            continue
+        metric = classify_metric_header(headers.get(col, f"column_{chr(64 + col)}"), col)
+        if metric is not None:
+            column_plan.append((col - 1, metric, col_date_map.get(col)))
+
+    # Prevent category names from being used as subcategory on category header rows
+    category_rows = {c['row'] for c in categories}
+    header_labels = CATEGORY_HEADER_LABELS | {c['name'] for c in categories}
+    plant_name = plant_name or None
+    part_name = part_name or None
+
     # Iterate through category rows
     for i in range(len(categories)):
         current = categories[i]
+        category = current['name']
         start_row = current['row']
         end_row = categories[i + 1]['row'] - 1 if i + 1 < len(categories) else min(start_row + 25, sheet.max_row)
 
         for row in range(start_row, end_row + 1):
-            subcat_cell = sheet.cell(row=row, column=subcategory_col).value
+            subcat_cell = sheet.value(row, subcategory_col)
             if not subcat_cell:
                 continue
             subcat = str(subcat_cell).strip()
-            # Prevent category names from being used as subcategory, especially from category header rows
-            category_names = set(c['name'] for c in categories)
-            full_category_names = {'Sales Price', 'Material', 'Investment', 'Tooling', 'Cycle Times', 'Headcount'}
-            
-            # Also check for multi-line category formats like "S\nSales Price", "M\nMaterial", etc.
-            category_multiline_patterns = {
-                'M\nMaterial', 'S\nSales Price', 'H\nHeadcount', 
-                'C\nCycle Time(s)\n(in JPH)', 'C\nCycle Times', 'C\nCycle Time(s)',
-                'I\nInvestment', 'T\nTooling'
-            }
-            
-            # Check if this row is a category header row (contains any category letter)
-            is_category_header_row = False
-            for cat in categories:
-                if row == cat['row']:  # This is a category header row
-                    # Check if the subcategory matches a category name or multiline pattern
-                    if (subcat in category_names or 
-                        subcat in full_category_names or 
-                        subcat in category_multiline_patterns):
-                        is_category_header_row = True
-                        break
-            
-            if is_category_header_row:
+            if row in category_rows and subcat in header_labels:
                 continue
 
-            for col in metric_cols:
-                val = sheet.cell(row=row, column=col).value
-                if not isinstance(val, (int, float)):
-                    continue
-
-                # Normalize header
-                raw_header = headers.get(col, f"column_{chr(64 + col)}").strip().lower().split('\n')[0]
-                if "cm%" in raw_header:
-                    continue
-
-                # Clean header for matching
-                cleaned_header = re.sub(r'[^a-z\s$\/→-]', '', raw_header.lower()).strip()
-
-                # Match against normalization dict
-                matched_key = next((k for k in METRIC_NORMALIZATION if k in cleaned_header), None)
-
-                if matched_key:
-                    metric = METRIC_NORMALIZATION[matched_key]
-                elif "quoted jph" in cleaned_header:
-                    metric = "Quoted_JPH"
-                elif "quoted $" in cleaned_header or "quoted $ / piece" in cleaned_header:
-                    metric = "Quoted_$"
-                elif "actual jph" in cleaned_header:
-                    metric = "Actual_JPH"
-                elif "actual $" in cleaned_header or "actual $ / piece" in cleaned_header:
-                    metric = "Actual_$"
-                elif "plex std" in cleaned_header and "jph" in cleaned_header:
-                    metric = "Plex_JPH"
-                elif "plex std" in cleaned_header and ("$" in cleaned_header or "piece" in cleaned_header):
-                    metric = "Plex_$"
-                else:
-                    metric = raw_header.split()[0].capitalize() if raw_header else f"Col_{col}"
-
-                date_str = col_date_map.get(col)
-
-                entry = {
-                    'Category': current['name'],
-                    'Subcategory': subcat,
-                    'Date': date_str,
-                    'Metric': metric,
-                    'Value': float(val)
-                }
-                if plant_name:
-                    entry['Plant'] = plant_name
-                if part_name:
-                    entry['Part Name'] = part_name
-
-                extracted.append(entry)
-
-    return extracted
-
-
-def extract_smitch_data_from_path(file_path):
+            values = sheet.rows[row - 1]
+            is_number = sheet.num_mask[row - 1]
+            sheet.touch(len(column_plan))
+            for idx, metric, date_str in column_plan:
+                if is_number[idx]:
+                    records.append(category, subcat, date_str, metric, float(values[idx]), plant_name, part_name)
+
+    return records
+
+def iter_scan_window(rows, max_rows, max_cols=EBIT_OH_SEARCH_COLS, ebit_max_rows=None):
+    """Yield worksheet rows until the detector scan window is filled.
+
+    The window is the first ``max_rows`` rows; if an EBIT block (first "OH"
+    cell within ``max_cols`` columns) has started but its LAB Total row has
+    not been reached yet, rows keep flowing until it is. Past the window,
+    rows up to ``ebit_max_rows`` are only checked for the OH anchor: when a
+    late EBIT block turns up, the rows skipped before it come out empty,
+    except the EBIT_HEADER_LOOKBACK rows above the anchor that hold its
+    metric headers. An anchor below ``ebit_max_rows`` is not seen.
+    """
+    if ebit_max_rows is None:
+        ebit_max_rows = max_rows
+    ebit_col = None
+    ebit_done = False
+    held = deque(maxlen=EBIT_HEADER_LOOKBACK)
+    skipped = 0
+    for row_idx, row in enumerate(rows, start=1):
+        anchor_row = False
+        if ebit_col is None:
+            for col_idx, val in enumerate(row[:max_cols - 1], start=1):
+                if isinstance(val, str) and val.strip().upper().startswith("OH"):
+                    ebit_col = col_idx
+                    anchor_row = True
+                    break
+            if ebit_col is None and row_idx > max_rows:
+                if row_idx >= ebit_max_rows:
+                    return
+                if len(held) == held.maxlen:
+                    skipped += 1
+                held.append(row)
+                continue
+        if held:
+            for _ in range(skipped):
+                yield ()
+            yield from held
+            held.clear()
+        yield row
+        if not anchor_row and ebit_col is not None and not ebit_done and ebit_col <= len(row):
+            val = row[ebit_col - 1]
+            ebit_done = isinstance(val, str) and classify_ebit_row(val) == "LAB Total"
+        if row_idx >= max_rows and (ebit_done or (ebit_col is None and row_idx >= ebit_max_rows)):
+            return
+
+
+def select_worksheets(workbook, selection=None):
+    """Worksheets to extract per Config.EXTRACT_SHEETS.
+
+    'active' is the active sheet only; 'all' is every visible worksheet; any
+    other value is a regular expression searched (case-insensitively) in the
+    names of the visible worksheets.
+    """
+    selection = Config.EXTRACT_SHEETS if selection is None else selection
+    if selection.lower() == 'active':
+        return [workbook.active]
+    visible = [ws for ws in workbook.worksheets if ws.sheet_state == 'visible']
+    if selection.lower() == 'all':
+        return visible
+    pattern = re.compile(selection, re.IGNORECASE)
+    return [ws for ws in visible if pattern.search(ws.title)]
+
+
+def load_sheet_snapshots(file_path, streaming=None, sheets=None):
+    """Load the selected sheets of a workbook (see select_worksheets) into SheetSnapshots.
+
+    The workbook is opened once whatever the number of sheets. In streaming
+    mode it is opened read-only and XML parsing of each sheet stops once the
+    scan window (Config.SCAN_MAX_ROWS x Config.SCAN_MAX_COLS plus the EBIT
+    block) is filled; otherwise the full object model is built.
+    """
     from openpyxl import load_workbook
-    wb = load_workbook(file_path, data_only=True)
-    ws = wb.active
+    if streaming is None:
+        streaming = Config.STREAMING_LOAD
 
-    metric_columns, headers, stop_column_found = detect_metric_columns(ws)
-    category_rows = detect_categories(ws)
-    subcategory_col = find_subcategory_column(ws, category_rows)
-    plant_name, plant_row = detect_plant(ws)
-    part_name = detect_part_name(ws, category_rows)
+    if not streaming:
+        wb = load_workbook(file_path, data_only=True)
+        return [SheetSnapshot.from_worksheet(ws) for ws in select_worksheets(wb, sheets)]
 
-    core_data = extract_smitch_data(ws, category_rows, metric_columns, headers, subcategory_col, plant_name, part_name)
-    apw_data = extract_weekly_apw(ws, plant_name, part_name)
-    ebit_data = extract_ebit_metrics(ws, plant_name, part_name, category_rows)
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        snapshots = []
+        for ws in select_worksheets(wb, sheets):
+            # Stored <dimension> tags are unreliable in files saved by other tools
+            ws.reset_dimensions()
+            rows = ws.iter_rows(max_col=Config.SCAN_MAX_COLS, values_only=True)
+            window = iter_scan_window(rows, Config.SCAN_MAX_ROWS, ebit_max_rows=Config.SCAN_EBIT_MAX_ROWS)
+            snapshots.append(SheetSnapshot(window, max_column=Config.SCAN_MAX_COLS, title=ws.title))
+        return snapshots
+    finally:
+        wb.close()
+
+
+def load_sheet_snapshot(file_path, streaming=None):
+    """Load the active sheet of a workbook into a SheetSnapshot"""
+    return load_sheet_snapshots(file_path, streaming=streaming, sheets='active')[0]
+
+
+def detect_layout(sheet, timer=profiling.NULL_TIMER):
+    """Run the layout detectors; the result is what utils.layout_cache stores per template"""
+    with timer.stage('detect_metric_columns'):
+        metric_columns, headers, stop_column_found = detect_metric_columns(sheet)
+    with timer.stage('detect_categories'):
+        category_rows = detect_categories(sheet)
+    with timer.stage('find_subcategory_column'):
+        subcategory_col = find_subcategory_column(sheet, category_rows)
+    with timer.stage('locate_ebit_anchor'):
+        ebit_anchor = locate_ebit_anchor(sheet)
+    return {
+        'metric_cols': metric_columns,
+        'headers': headers,
+        'stop_column': stop_column_found,
+        'categories': category_rows,
+        'subcategory_col': subcategory_col,
+        'ebit_anchor': ebit_anchor,
+    }
 
-    return core_data + apw_data + ebit_data
+def validate_layout(sheet, layout):
+    """Check a cached layout against the part of the sheet its fingerprint does not cover.
+
+    The fingerprint pins down everything the header, category and subcategory
+    detectors read; the EBIT block can start anywhere, so the first "OH" cell
+    is located again (cheap on the string mask) and must be the cached anchor.
+    """
+    try:
+        return locate_ebit_anchor(sheet) == tuple(layout['ebit_anchor'])
+    except (KeyError, TypeError, ValueError):
+        return False
+
+def load_layout(sheet, timer=profiling.NULL_TIMER):
+    """Layout from the template cache when enabled and valid, else freshly detected"""
+    cache = None
+    if Config.LAYOUT_CACHE:
+        from utils.layout_cache import default_cache, sheet_fingerprint
+        cache = default_cache()
+    if cache is None:
+        return detect_layout(sheet, timer)
+
+    with timer.stage('layout_cache'):
+        fingerprint = sheet_fingerprint(sheet)
+        layout = cache.get(fingerprint)
+        if layout is not None and not validate_layout(sheet, layout):
+            cache.invalidate(fingerprint)
+            layout = None
+    if layout is None:
+        layout = detect_layout(sheet, timer)
+        cache.put(fingerprint, layout)
+    return layout
+
+def extract_smitch_data_from_path(file_path, streaming=None, timer=None, out=None):
+    """Extract all S.M.I.T.C.H., Weekly APW and EBIT rows from a workbook.
+
+    Rows are appended to ``out`` (a new RecordBuffer if not given), which is
+    returned. ``timer`` (a profiling.StageTimer) records per-stage timings;
+    when none is given and Config.EXTRACTION_TIMING is on, one is created and
+    the result is appended to the timing log.
+    """
+    if timer is None and Config.EXTRACTION_TIMING:
+        with profiling.instrumented(file_path) as timer:
+            return _extract_from_path(file_path, streaming, timer, out)
+    return _extract_from_path(file_path, streaming, timer or profiling.NULL_TIMER, out)
+
+
+def _extract_from_path(file_path, streaming, timer, out=None):
+    # Read every cell once; all detectors below work off these snapshots
+    with timer.stage('load_workbook') as stage:
+        sheets = load_sheet_snapshots(file_path, streaming=streaming)
+        stage['cells'] = sum(ws.max_row * ws.max_column for ws in sheets)
+
+    records = RecordBuffer() if out is None else out
+    # Rows carry their sheet name only when more than the active sheet can be extracted
+    tag_sheets = Config.EXTRACT_SHEETS.lower() != 'active'
+    for ws in sheets:
+        if tag_sheets:
+            records.begin_sheet(ws.title)
+        _extract_sheet(timer.attach(ws), file_path, timer, records)
+    return records
+
+
+def _extract_sheet(ws, file_path, timer, records):
+    layout = load_layout(ws, timer)
+    category_rows = layout['categories']
+    with timer.stage('detect_plant'):
+        plant_name, plant_row = detect_plant(ws, file_path)
+    with timer.stage('detect_part_name'):
+        part_name = detect_part_name(ws, category_rows)
+
+    with timer.stage('extract_smitch_data') as stage:
+        before = len(records)
+        extract_smitch_data(ws, category_rows, layout['metric_cols'], layout['headers'], layout['subcategory_col'],
+                            plant_name, part_name, out=records)
+        stage['rows'] = len(records) - before
+    with timer.stage('extract_weekly_apw') as stage:
+        before = len(records)
+        extract_weekly_apw(ws, plant_name, part_name, out=records)
+        stage['rows'] = len(records) - before
+    with timer.stage('extract_ebit_metrics') as stage:
+        before = len(records)
+        extract_ebit_metrics(ws, plant_name, part_name, category_rows, out=records, anchor=layout['ebit_anchor'])
+        stage['rows'] = len(records) - before
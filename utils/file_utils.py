@@ -1,7 +1,35 @@
 import os
 
-def get_file_metadata(path):
-    try:
-        return os.path.getmtime(path)
-    except:
-        return None
+WORKBOOK_EXTENSIONS = ('.xlsm', '.xlsx')
+
+def is_temp_file(name):
+    """Office owner/lock files (~$Book.xlsx) and LibreOffice locks (.~lock.Book.xlsx#)"""
+    return name.startswith(('~$', '.~lock.'))
+
+def scan_workbooks(root, extensions=WORKBOOK_EXTENSIONS):
+    """Yield (path, stat_result) for every workbook under ``root``.
+
+    Uses os.scandir so the directory listing and the stat come from the same
+    pass (on Windows the stat is served from the listing without a syscall).
+    Office lock files, unreadable directories and files that vanish
+    mid-scan are skipped.
+    """
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(extensions) and not is_temp_file(entry.name):
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+def newest_first(scanned):
+    """Sort (path, stat_result) pairs by modification time, most recent first"""
+    return sorted(scanned, key=lambda item: item[1].st_mtime, reverse=True)
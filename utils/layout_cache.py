@@ -0,0 +1,146 @@
+"""Persistent cache of detected workbook layouts.
+
+Most plants fill in the same SMITCH template, so the metric columns,
+category rows, subcategory column and EBIT anchor come out the same for
+dozens of workbooks. The layout detected for one of them is stored under a
+structural fingerprint of the sheet:
+
+- the text of the header rows (rows 1-5, columns 1-19), which is all that
+  detect_metric_columns reads, and
+- how each string cell of the category/subcategory region (rows 1-49,
+  columns 1-6) reads to those detectors (``extractor.label_code``: category
+  marker letter, category description, other text), so a template with the
+  same cells but different labels gets a different fingerprint.
+
+The EBIT anchor can be anywhere in the sheet, so a later workbook with the
+same fingerprint reuses the layout only after ``extractor.validate_layout``
+has found the same first "OH" cell; if that fails the layout is detected again and the entry replaced. Entries are
+keyed by extractor_version() as well, so layouts detected by older code
+are never reused. The cache lives in SQLite next to the manifest and is
+shared by the watcher's workers and test_runner's processes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from utils.extractor import label_code
+from utils.manifest import extractor_version
+
+HEADER_ROWS = 5
+HEADER_COLS = 19
+LABEL_ROWS = 49
+LABEL_COLS = 6
+
+
+def sheet_fingerprint(sheet):
+    """Structural fingerprint of a SheetSnapshot (see module docstring)"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{sheet.max_column}".encode())
+    for row, mask in zip(sheet.rows[:HEADER_ROWS], sheet.str_mask[:HEADER_ROWS]):
+        h.update('\x1f'.join(v if m else '' for v, m in zip(row[:HEADER_COLS], mask)).encode('utf-8', 'surrogatepass'))
+        h.update(b'\x1e')
+    for row, mask in zip(sheet.rows[:LABEL_ROWS], sheet.str_mask[:LABEL_ROWS]):
+        h.update('\x1f'.join(label_code(v) if m else '' for v, m in zip(row[:LABEL_COLS], mask)).encode())
+        h.update(b'\x1e')
+    return h.hexdigest()
+
+
+def encode_layout(layout):
+    # JSON object keys are strings; headers are keyed by column number
+    return json.dumps(dict(layout, headers=list(layout['headers'].items())))
+
+
+def decode_layout(text):
+    layout = json.loads(text)
+    layout['headers'] = {int(col): header for col, header in layout['headers']}
+    if layout['ebit_anchor'] is not None:
+        layout['ebit_anchor'] = tuple(layout['ebit_anchor'])
+    return layout
+
+
+class LayoutCache:
+    """Fingerprint -> layout dict, persisted in SQLite and mirrored in memory"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS layouts (
+            fingerprint TEXT PRIMARY KEY,
+            extractor_version TEXT,
+            layout TEXT,
+            updated_at REAL
+        )
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or Config.LAYOUT_CACHE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._layouts = {}
+        self.stats = {'hits': 0, 'misses': 0, 'invalid': 0}
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(self.SCHEMA)
+            rows = self._conn.execute(
+                "SELECT fingerprint, layout FROM layouts WHERE extractor_version = ?", (extractor_version(),)
+            ).fetchall()
+        for fingerprint, text in rows:
+            try:
+                self._layouts[fingerprint] = decode_layout(text)
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def get(self, fingerprint):
+        """Cached layout for a fingerprint, or None"""
+        with self._lock:
+            layout = self._layouts.get(fingerprint)
+            self.stats['hits' if layout is not None else 'misses'] += 1
+        return layout
+
+    def put(self, fingerprint, layout):
+        with self._lock:
+            self._layouts[fingerprint] = layout
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO layouts (fingerprint, extractor_version, layout, updated_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (fingerprint, extractor_version(), encode_layout(layout), time.time()),
+                    )
+            except sqlite3.Error:
+                # Still cached for this process; another one may be holding the write lock
+                pass
+
+    def invalidate(self, fingerprint):
+        """Drop a cached layout that failed validation"""
+        with self._lock:
+            self._layouts.pop(fingerprint, None)
+            self.stats['hits'] -= 1
+            self.stats['invalid'] += 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    """Process-wide LayoutCache at Config.LAYOUT_CACHE_PATH (None when disabled or unusable)"""
+    global _default
+    if not Config.LAYOUT_CACHE:
+        return None
+    with _default_lock:
+        if _default is None:
+            try:
+                _default = LayoutCache()
+            except sqlite3.Error:
+                # Extraction must not depend on the cache (e.g. LOG_PATH on a share SQLite cannot lock)
+                _default = False
+        return _default or None
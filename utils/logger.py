@@ -1,20 +1,181 @@
 import os
+import glob
 import json
+import time
+import logging
+import contextlib
 
 LOG_FILE = "logs/processed_files.json"
+# Journal size on disk (bytes, all processes' appends) at which it is compacted into the JSON file
+JOURNAL_COMPACT_BYTES = 256 * 1024
+# A compaction lock older than this was left behind by a crashed process
+COMPACT_LOCK_STALE_SECONDS = 300
 
-def load_processed_log():
-    if not os.path.exists(LOG_FILE):
-        return {}
+logger = logging.getLogger(__name__)
+
+def journal_path(path=LOG_FILE):
+    """Append-only journal of per-file updates made since the log was last compacted"""
+    return f"{path}.journal"
+
+def journal_size(path=LOG_FILE):
+    try:
+        return os.path.getsize(journal_path(path))
+    except OSError:
+        return 0
+
+def _aside_journals(path):
+    # Journals renamed aside by a compaction, oldest first; one left over means it crashed
+    aside = []
+    for name in glob.glob(glob.escape(journal_path(path)) + ".*.compacting"):
+        try:
+            aside.append((os.path.getmtime(name), name))
+        except OSError:
+            continue
+    return [name for _, name in sorted(aside)]
 
+def _fsync_dir(directory):
+    # Makes the rename itself durable; directories cannot be opened for fsync on Windows
+    if os.name == 'nt':
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
     try:
-        with open(LOG_FILE, "r") as f:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write_json(data, path, indent=4):
+    """Write JSON to ``path`` via a temp file, fsync and rename: readers see the old or the new file, never a torn one"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+def load_processed_log(path=LOG_FILE):
+    """Processed log: the last compacted JSON file with the journals replayed on top"""
+    log = _load_snapshot(path)
+    for journal in _aside_journals(path) + [journal_path(path)]:
+        _replay(log, _read_journal(journal))
+    return log
+
+def _load_snapshot(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
             return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        # Log file exists but is corrupted or empty → reset
+    except (json.JSONDecodeError, IOError) as e:
+        # Only logs written before atomic writes can be torn; the journal may still help
+        logger.warning(f"Processed log {path} is unreadable ({e}); starting from its journal")
         return {}
 
-def update_log(new_log):
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-    with open(LOG_FILE, "w") as f:
-        json.dump(new_log, f, indent=4)
+def _replay(log, entries):
+    for key, value in entries:
+        if value is None:
+            log.pop(key, None)
+        else:
+            log[key] = value
+
+def _read_journal(journal):
+    if not os.path.exists(journal):
+        return []
+    entries = []
+    try:
+        with open(journal, "r") as f:
+            for line in f:
+                try:
+                    key, value = json.loads(line)
+                except (ValueError, TypeError):
+                    # A crash mid-append leaves at most one partial (last) line
+                    continue
+                entries.append((key, value))
+    except IOError as e:
+        logger.warning(f"Could not read journal {journal}: {e}")
+    return entries
+
+def append_log_entries(entries, path=LOG_FILE):
+    """Durably append (key, value) updates to the journal; a None value removes the key"""
+    journal = journal_path(path)
+    directory = os.path.dirname(journal)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lines = ''.join(json.dumps([key, value]) + '\n' for key, value in entries).encode()
+    with open(journal, "ab+") as f:
+        # Start on a fresh line if a crash left a partial one at the end
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                lines = b'\n' + lines
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+@contextlib.contextmanager
+def _compaction_lock(path):
+    """Serialize compactions across processes with an O_EXCL lock file next to the log"""
+    lock = f"{path}.lock"
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > COMPACT_LOCK_STALE_SECONDS:
+                    os.remove(lock)
+                    continue
+            except OSError:
+                continue
+            time.sleep(0.05)
+    os.close(fd)
+    try:
+        yield
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(lock)
+
+def rewrite_log(build, path=LOG_FILE):
+    """Atomically replace the JSON log with ``build(current log)``; returns what was written.
+
+    The journal is renamed aside before it is read, so entries other
+    processes append meanwhile go to a fresh journal and survive; the aside
+    file is only removed once the new JSON file is in place (and is replayed
+    by load_processed_log if we crash before that).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with _compaction_lock(path):
+        aside = f"{journal_path(path)}.{os.getpid()}-{time.time_ns()}.compacting"
+        try:
+            os.rename(journal_path(path), aside)
+        except FileNotFoundError:
+            pass
+        except PermissionError:
+            # Windows: another process is appending; its journal stays and is replayed on top
+            pass
+        journals = _aside_journals(path)
+        log = _load_snapshot(path)
+        for journal in journals:
+            _replay(log, _read_journal(journal))
+        new_log = build(log)
+        atomic_write_json(new_log, path, indent=4)
+        for journal in journals:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(journal)
+    return new_log
+
+def compact_log(path=LOG_FILE):
+    """Fold the journal into the JSON log"""
+    return rewrite_log(lambda log: log, path)
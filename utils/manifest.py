@@ -0,0 +1,254 @@
+"""Processed-files manifest.
+
+Tracks, per workbook path, the size, mtime, content hash, extractor version
+and output file of the last successful extraction. A file is re-extracted
+only when its bytes or the extraction code changed: OneDrive rewrites
+mtimes on sync, so an mtime/size mismatch is confirmed with a content hash
+before any work is done.
+
+Two backends share the same interface:
+- ``SqliteManifest`` (default): indexed lookups, transactional updates.
+- ``JsonManifest``: the legacy ``logs/processed_files.json`` path -> mtime map,
+  for deployments where LOG_PATH lives on a share SQLite cannot lock. Updates
+  are appended to a journal, which is compacted into the JSON file once it
+  grows past JOURNAL_COMPACT_BYTES on disk (checked after each update and
+  when the process exits), so a crash mid-write never loses the log.
+"""
+
+import hashlib
+import importlib.util
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from utils.logger import (
+    JOURNAL_COMPACT_BYTES, LOG_FILE, append_log_entries, compact_log, journal_size, load_processed_log,
+)
+
+# Modules whose source defines the extraction output; editing any of them
+# changes extractor_version() and forces re-extraction
+EXTRACTION_MODULES = ('utils.extractor', 'utils.records', 'utils.sheet_snapshot', 'utils.layout_cache')
+
+_HASH_CHUNK = 1024 * 1024
+_extractor_version = None
+
+
+def file_hash(path):
+    """Fast content hash of a file (BLAKE2b, 128-bit)"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def extractor_version():
+    """Hash of the extraction modules' source, computed once per process"""
+    global _extractor_version
+    if _extractor_version is None:
+        h = hashlib.blake2b(digest_size=8)
+        for name in EXTRACTION_MODULES:
+            spec = importlib.util.find_spec(name)
+            with open(spec.origin, 'rb') as f:
+                h.update(f.read())
+        _extractor_version = h.hexdigest()
+    return _extractor_version
+
+
+def with_content_hash(path, state):
+    """``state`` with its content hash filled in if the manifest left it to be computed.
+
+    Called by the extracting worker before it reads the workbook, so the
+    recorded hash matches what was read.
+    """
+    if 'content_hash' in state and state['content_hash'] is None:
+        return dict(state, content_hash=file_hash(path))
+    return state
+
+
+def file_state(path, st=None):
+    """Current (size, mtime) of a file as a state dict; content hash filled lazily"""
+    if st is None:
+        st = os.stat(path)
+    return {'size': st.st_size, 'mtime': st.st_mtime, 'content_hash': None}
+
+
+class SqliteManifest:
+    """Manifest stored in a SQLite database (one row per workbook path)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            content_hash TEXT,
+            extractor_version TEXT,
+            output_path TEXT,
+            updated_at REAL,
+            output_fingerprint TEXT
+        )
+    """
+    COLUMNS = ('path', 'size', 'mtime', 'content_hash', 'extractor_version',
+               'output_path', 'updated_at', 'output_fingerprint')
+
+    def __init__(self, db_path=None, legacy_json=LOG_FILE):
+        self.db_path = db_path or Config.MANIFEST_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # Shared by the watcher's worker threads; all access goes through self._lock
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(self.SCHEMA)
+            existing = {r[1] for r in self._conn.execute("PRAGMA table_info(files)")}
+            if 'output_fingerprint' not in existing:
+                # Manifests created before output fingerprints were recorded
+                self._conn.execute("ALTER TABLE files ADD COLUMN output_fingerprint TEXT")
+        if legacy_json:
+            self.migrate_json(legacy_json)
+
+    def migrate_json(self, json_path):
+        """Import the legacy path -> mtime JSON log into an empty manifest"""
+        if not os.path.exists(json_path):
+            return 0
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone():
+                return 0
+        legacy = load_processed_log(json_path)
+        now = time.time()
+        # Size and hash are unknown; they are backfilled the first time the
+        # file is seen with an unchanged mtime, without re-extracting it
+        rows = [
+            (path, None, mtime, None, extractor_version(), None, now, None)
+            for path, mtime in legacy.items() if mtime is not None
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(self._insert_sql('INSERT OR IGNORE'), rows)
+        return len(rows)
+
+    def get(self, path):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row else None
+
+    def paths(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT path FROM files")]
+
+    def needs_extraction(self, path, st=None):
+        """Return (needed, state) for a workbook.
+
+        ``state`` is the file's current size/mtime (plus content hash when it
+        had to be computed) and is what ``record`` should store afterwards.
+        A new or outdated entry needs extraction whatever the content, so its
+        hash is left to the worker that extracts it (``with_content_hash``).
+        """
+        state = file_state(path, st)
+        entry = self.get(path)
+        if entry is None or entry['extractor_version'] != extractor_version():
+            return True, state
+
+        same_stat = entry['mtime'] == state['mtime'] and entry['size'] in (None, state['size'])
+        if same_stat and entry['content_hash'] is not None and entry['size'] is not None:
+            return False, state
+
+        state['content_hash'] = file_hash(path)
+        if same_stat or entry['content_hash'] == state['content_hash']:
+            # Only the stat changed (sync touched it) or a migrated row lacks a hash
+            self._touch(path, state)
+            return False, state
+        return True, state
+
+    def _touch(self, path, state):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE files SET size = ?, mtime = ?, content_hash = ?, updated_at = ? WHERE path = ?",
+                (state['size'], state['mtime'], state['content_hash'], time.time(), path),
+            )
+
+    def record(self, path, state, output_path=None):
+        self.record_many([(path, state, output_path)])
+
+    def record_many(self, entries):
+        """Upsert (path, state, output_path) tuples in a single transaction.
+
+        ``state['fingerprint']``, when present, is stored as the fingerprint
+        of the rows written to ``output_path``.
+        """
+        now = time.time()
+        version = extractor_version()
+        rows = []
+        for path, state, output_path in entries:
+            content_hash = state.get('content_hash') or file_hash(path)
+            rows.append((path, state['size'], state['mtime'], content_hash, version, output_path, now,
+                         state.get('fingerprint')))
+        with self._lock, self._conn:
+            self._conn.executemany(self._insert_sql('INSERT OR REPLACE'), rows)
+
+    @classmethod
+    def _insert_sql(cls, verb):
+        return f"{verb} INTO files ({', '.join(cls.COLUMNS)}) VALUES ({', '.join('?' * len(cls.COLUMNS))})"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JsonManifest:
+    """Legacy backend: path -> mtime in logs/processed_files.json.
+
+    Output fingerprints are not kept, so unchanged outputs are always rewritten.
+    """
+
+    def __init__(self, json_path=LOG_FILE, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.json_path = json_path
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+        self._log = load_processed_log(json_path)
+
+    def get(self, path):
+        mtime = self._log.get(path)
+        return None if mtime is None else {'path': path, 'mtime': mtime}
+
+    def paths(self):
+        return list(self._log)
+
+    def needs_extraction(self, path, st=None):
+        state = file_state(path, st)
+        # Only the mtime is stored, so no content hash is ever computed for it
+        del state['content_hash']
+        return self._log.get(path) != state['mtime'], state
+
+    def record(self, path, state, output_path=None):
+        self.record_many([(path, state, output_path)])
+
+    def record_many(self, entries):
+        with self._lock:
+            updates = [(path, state['mtime']) for path, state, _ in entries]
+            append_log_entries(updates, self.json_path)
+            self._log.update(updates)
+            # The size on disk counts every process's appends (e.g. subprocess-mode runs)
+            if journal_size(self.json_path) >= self.compact_bytes:
+                self._log = compact_log(self.json_path)
+
+    def close(self):
+        """Fold the journal into the JSON file if it is past compact_bytes.
+
+        A smaller journal is left for the next process to replay: one-file
+        runs (e.g. each test_runner.py --file subprocess) would otherwise
+        rewrite the whole JSON file on every exit.
+        """
+        with self._lock:
+            if journal_size(self.json_path) >= self.compact_bytes:
+                self._log = compact_log(self.json_path)
+
+
+def open_manifest(backend=None):
+    """Open the manifest selected by Config.MANIFEST_BACKEND ('sqlite' or 'json')"""
+    backend = (backend or Config.MANIFEST_BACKEND).lower()
+    if backend == 'json':
+        return JsonManifest()
+    return SqliteManifest()
@@ -0,0 +1,156 @@
+"""
+Incremental stat-based polling watcher for synced (OneDrive/SharePoint) folders.
+
+Native change notifications on synced folders arrive in noisy bursts and are
+sometimes lost. This poller instead keeps, per directory, its mtime and the
+(size, mtime) of each workbook in it. Each cycle stats only the known
+directories; a directory is listed again only when its own mtime changed
+(a file was created, removed or renamed in it, which is how Excel and the
+sync client save). In-place rewrites do not touch the directory mtime, so
+every ``full_scan_every`` cycles all directories are listed regardless.
+
+The loop sleeps at least ``interval`` seconds between cycles, and longer
+when a cycle was expensive, so scanning uses at most ``max_cpu`` of one core.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from utils.file_utils import WORKBOOK_EXTENSIONS, is_temp_file
+
+logger = logging.getLogger(__name__)
+
+
+class _DirState:
+    __slots__ = ('mtime', 'files', 'subdirs')
+
+    def __init__(self, mtime, files, subdirs):
+        self.mtime = mtime
+        self.files = files
+        self.subdirs = subdirs
+
+
+class IncrementalPoller:
+    """Calls ``on_change(path)`` for workbooks created or modified under ``root``.
+
+    Exposes start()/stop()/join() like a watchdog observer.
+    """
+
+    def __init__(self, root, on_change, interval=5.0, max_cpu=0.1, full_scan_every=12,
+                 extensions=WORKBOOK_EXTENSIONS):
+        self.root = root
+        self.on_change = on_change
+        self.interval = interval
+        self.max_cpu = max_cpu
+        self.full_scan_every = full_scan_every
+        self.extensions = extensions
+
+        self._dirs = {}
+        self._primed = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_scan = {'seconds': 0.0, 'dirs': 0, 'listed': 0, 'files': 0, 'changed': 0}
+
+    # -- public API ------------------------------------------------------
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='smitch-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def poll_once(self, full=False):
+        """Run one scan cycle; returns the workbook paths that changed.
+
+        The first cycle only records the baseline (startup catch-up is the
+        watcher's reconciliation scan), so it returns nothing.
+        """
+        start = time.perf_counter()
+        changed = []
+        seen = set()
+        listed = 0
+        stack = [self.root]
+        while stack:
+            folder = stack.pop()
+            seen.add(folder)
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            prev = self._dirs.get(folder)
+            if prev is not None and prev.mtime == mtime and not full:
+                stack.extend(prev.subdirs)
+                continue
+
+            files, subdirs = self._list(folder)
+            listed += 1
+            if self._primed:
+                old_files = prev.files if prev is not None else {}
+                for name, signature in files.items():
+                    if old_files.get(name) != signature:
+                        changed.append(os.path.join(folder, name))
+            self._dirs[folder] = _DirState(mtime, files, subdirs)
+            stack.extend(subdirs)
+
+        for folder in [d for d in self._dirs if d not in seen]:
+            del self._dirs[folder]
+        self._primed = True
+
+        self.last_scan = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'dirs': len(self._dirs),
+            'listed': listed,
+            'files': sum(len(d.files) for d in self._dirs.values()),
+            'changed': len(changed),
+        }
+        return changed
+
+    # -- internals -------------------------------------------------------
+
+    def _list(self, folder):
+        """(workbook name -> (size, mtime_ns), subdirectory paths) for one directory"""
+        files, subdirs = {}, []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.name.endswith(self.extensions) and not is_temp_file(entry.name):
+                            st = entry.stat()
+                            files[entry.name] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return files, subdirs
+
+    def _run(self):
+        cycle = 0
+        while not self._stop.is_set():
+            cpu_start = time.thread_time()
+            full = bool(self.full_scan_every) and cycle > 0 and cycle % self.full_scan_every == 0
+            try:
+                for path in self.poll_once(full=full):
+                    self.on_change(path)
+            except Exception as e:
+                logger.error(f"Polling {self.root} failed: {e}")
+            cycle += 1
+
+            # Stretch the pause so scan time stays under max_cpu of one core
+            cpu = time.thread_time() - cpu_start
+            wait = self.interval
+            if self.max_cpu > 0:
+                wait = max(wait, cpu / self.max_cpu - cpu)
+            self._stop.wait(wait)
@@ -0,0 +1,126 @@
+"""Opt-in per-stage instrumentation for extract_smitch_data_from_path.
+
+With EXTRACTION_TIMING=true every extraction records wall time, cells read
+and rows emitted for each stage (load, each detector, each extractor) and
+appends one JSON line per file to LOG_PATH/extraction_timing.jsonl. When
+PROFILE_THRESHOLD_SECONDS > 0 the extraction also runs under cProfile and
+the stats are dumped to LOG_PATH/profiles/ for files slower than that.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from config import Config
+from utils.sheet_snapshot import CountingSnapshot
+
+TIMING_LOG_NAME = 'extraction_timing.jsonl'
+PROFILE_DIR_NAME = 'profiles'
+
+_log_lock = threading.Lock()
+
+
+class StageTimer:
+    """Collects per-stage wall time, cell reads and emitted rows for one file"""
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.stages = []
+        self.sheet = None
+
+    def attach(self, snapshot):
+        """Wrap the loaded snapshot so detector cell reads are counted"""
+        self.sheet = CountingSnapshot.wrap(snapshot)
+        return self.sheet
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage; the caller may set entry['rows'] / entry['cells']"""
+        entry = {'stage': name, 'seconds': 0.0, 'cells': 0, 'rows': 0}
+        reads_before = self.sheet.reads if self.sheet is not None else 0
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry['seconds'] = round(time.perf_counter() - start, 6)
+            if self.sheet is not None:
+                entry['cells'] += self.sheet.reads - reads_before
+            self.stages.append(entry)
+
+    def summary(self):
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'file': self.file_path,
+            'total_seconds': round(sum(s['seconds'] for s in self.stages), 6),
+            'cells': sum(s['cells'] for s in self.stages),
+            'rows': sum(s['rows'] for s in self.stages),
+            'stages': self.stages,
+        }
+
+
+class NullTimer:
+    """Stand-in used when instrumentation is off; adds no per-read overhead"""
+
+    _entry = {}
+
+    def attach(self, snapshot):
+        return snapshot
+
+    def stage(self, name):
+        return contextlib.nullcontext(self._entry)
+
+
+NULL_TIMER = NullTimer()
+
+
+def write_timing(record, log_path=None):
+    """Append one JSON line to the timing log"""
+    log_path = log_path or os.path.join(Config.LOG_PATH, TIMING_LOG_NAME)
+    os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+    line = json.dumps(record, default=str) + '\n'
+    with _log_lock, open(log_path, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+
+@contextlib.contextmanager
+def instrumented(file_path, threshold=None):
+    """Yield a StageTimer for one extraction and log it when the block exits.
+
+    If ``threshold`` (default Config.PROFILE_THRESHOLD_SECONDS) is positive,
+    the block runs under cProfile and the profile is kept only for files
+    that took longer than the threshold.
+    """
+    if threshold is None:
+        threshold = Config.PROFILE_THRESHOLD_SECONDS
+    timer = StageTimer(file_path)
+    profiler = None
+    if threshold > 0:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another thread's profiler is active (one at a time on 3.12+)
+            profiler = None
+
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        elapsed = time.perf_counter() - start
+        record = timer.summary()
+        record['wall_seconds'] = round(elapsed, 6)
+        record['profile'] = None
+        if profiler is not None:
+            profiler.disable()
+            if elapsed > threshold:
+                profile_dir = os.path.join(Config.LOG_PATH, PROFILE_DIR_NAME)
+                os.makedirs(profile_dir, exist_ok=True)
+                stem = os.path.splitext(os.path.basename(file_path))[0]
+                profile_path = os.path.join(profile_dir, f"{stem}_{datetime.now():%Y%m%d_%H%M%S}.prof")
+                profiler.dump_stats(profile_path)
+                record['profile'] = profile_path
+        write_timing(record)
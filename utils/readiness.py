@@ -0,0 +1,113 @@
+"""
+Write-stability check run before a workbook is extracted.
+
+Excel, OneDrive and SharePoint sync write workbooks in several steps, so a
+change event can arrive while the file is still half written or half
+downloaded. A file is considered ready when:
+
+- its size and mtime have not changed for ``window`` seconds (checked
+  across scheduler passes, never by sleeping), and
+- it is a complete zip archive: the end-of-central-directory record is
+  present and points at a central directory inside the file.
+
+Both checks read a few bytes and a stat, so they are cheap enough to run
+on every pass. Files that are not ready are re-queued by the caller.
+"""
+
+import os
+import struct
+import threading
+import time
+
+READY = 'ready'
+WAIT = 'wait'
+GONE = 'gone'
+TIMED_OUT = 'timed_out'
+
+_LOCAL_HEADER = b'PK\x03\x04'
+_CENTRAL_HEADER = b'PK\x01\x02'
+_EOCD = b'PK\x05\x06'
+_EOCD_STRUCT = struct.Struct('<4s4H2LH')
+# EOCD record plus the longest possible archive comment
+_EOCD_SEARCH = _EOCD_STRUCT.size + 0xFFFF
+
+
+def is_complete_zip(path):
+    """True if ``path`` starts like a zip and its central directory is intact"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(4) != _LOCAL_HEADER:
+                return False
+            size = f.seek(0, os.SEEK_END)
+            tail_len = min(size, _EOCD_SEARCH)
+            f.seek(size - tail_len)
+            tail = f.read(tail_len)
+            pos = tail.rfind(_EOCD)
+            if pos < 0 or len(tail) - pos < _EOCD_STRUCT.size:
+                return False
+            _, _, _, _, entries, cd_size, cd_offset, _ = _EOCD_STRUCT.unpack_from(tail, pos)
+            if cd_offset == 0xFFFFFFFF:
+                # Zip64: the record was written last, which is what matters here
+                return True
+            if cd_offset + cd_size > size - tail_len + pos:
+                return False
+            if entries == 0:
+                return True
+            f.seek(cd_offset)
+            return f.read(4) == _CENTRAL_HEADER
+    except OSError:
+        return False
+
+
+class ReadinessTracker:
+    """Remembers each pending file's last (size, mtime) to judge stability.
+
+    ``check(path)`` returns READY, WAIT (call again later), GONE (file
+    disappeared) or TIMED_OUT (not ready after ``max_wait`` seconds).
+    """
+
+    def __init__(self, window=2.0, max_wait=600.0):
+        self.window = window
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        # path -> (signature, stable_since, first_seen)
+        self._pending = {}
+
+    def check(self, path):
+        now = time.time()
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.forget(path)
+            return GONE
+        except OSError:
+            return self._wait(path, None, now)
+
+        signature = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            previous = self._pending.get(path)
+        if previous is None:
+            # Untouched for a full window already (e.g. found by the startup scan)
+            stable = now - st.st_mtime >= self.window
+        else:
+            stable = previous[0] == signature and now - previous[1] >= self.window
+
+        if stable and st.st_size > 0 and is_complete_zip(path):
+            self.forget(path)
+            return READY
+        return self._wait(path, signature, now)
+
+    def forget(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def _wait(self, path, signature, now):
+        with self._lock:
+            previous = self._pending.get(path)
+            first_seen = previous[2] if previous else now
+            if now - first_seen >= self.max_wait:
+                self._pending.pop(path, None)
+                return TIMED_OUT
+            if previous is None or previous[0] != signature:
+                self._pending[path] = (signature, now, first_seen)
+        return WAIT
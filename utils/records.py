@@ -0,0 +1,242 @@
+"""Fixed-schema, column-oriented storage for extracted rows.
+
+Every extractor appends into a RecordBuffer instead of building a dict per
+row. Label columns (Category, Subcategory, Date, Metric, Plant, Part Name)
+are dictionary-encoded: each distinct string is stored once and rows hold
+an int32 code, and Value is a packed array of doubles. Building a DataFrame
+is then a buffer copy per column, and the label columns become categoricals
+straight from their codes without re-factorizing the strings.
+
+Source file and worksheet tags are kept as runs (label, first row) rather
+than per row, and become the optional 'Source File' / 'Sheet' columns.
+"""
+
+import hashlib
+from array import array
+from itertools import chain, repeat
+
+COLUMNS = ('Category', 'Subcategory', 'Date', 'Metric', 'Value', 'Plant', 'Part Name')
+CATEGORICAL_COLUMNS = ('Category', 'Subcategory', 'Metric', 'Plant', 'Part Name')
+SOURCE_COLUMN = 'Source File'
+SHEET_COLUMN = 'Sheet'
+
+
+class SmitchRecord:
+    """One extracted row; reads like the old row dict (``r['Value']``, ``dict(r)``)"""
+
+    __slots__ = ('category', 'subcategory', 'date', 'metric', 'value', 'plant', 'part_name')
+
+    def __init__(self, category, subcategory, date, metric, value, plant, part_name):
+        self.category = category
+        self.subcategory = subcategory
+        self.date = date
+        self.metric = metric
+        self.value = value
+        self.plant = plant
+        self.part_name = part_name
+
+    def keys(self):
+        return COLUMNS
+
+    def __getitem__(self, key):
+        return getattr(self, _ATTRIBUTES[key])
+
+    def as_dict(self):
+        return dict(zip(COLUMNS, (getattr(self, name) for name in self.__slots__)))
+
+    def __eq__(self, other):
+        if not isinstance(other, SmitchRecord):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self):
+        return f"SmitchRecord({self.as_dict()!r})"
+
+
+_ATTRIBUTES = dict(zip(COLUMNS, SmitchRecord.__slots__))
+
+
+class LabelColumn:
+    """Dictionary-encoded string column: int32 codes into unique labels (-1 = None)"""
+
+    __slots__ = ('codes', 'labels', '_index')
+
+    def __init__(self):
+        self.codes = array('i')
+        self.labels = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, label):
+        if label is None:
+            self.codes.append(-1)
+            return
+        code = self._index.get(label)
+        if code is None:
+            code = self._index[label] = len(self.labels)
+            self.labels.append(label)
+        self.codes.append(code)
+
+    def values(self):
+        labels = self.labels
+        return [labels[c] if c >= 0 else None for c in self.codes]
+
+    def truncate(self, length):
+        del self.codes[length:]
+
+    def to_array(self, categorical=True):
+        """pandas Categorical (or object ndarray) built from the codes"""
+        import numpy as np
+        import pandas as pd
+
+        codes = np.frombuffer(self.codes, dtype=np.intc).copy() if self.codes else np.array([], dtype=np.intc)
+        if categorical:
+            return pd.Categorical.from_codes(codes, categories=pd.Index(self.labels, dtype=object))
+        # The trailing None is what code -1 picks up
+        return np.array(self.labels + [None], dtype=object)[codes]
+
+
+class RecordBuffer:
+    """Fixed-schema store of extracted rows; see module docstring"""
+
+    def __init__(self):
+        self.category = LabelColumn()
+        self.subcategory = LabelColumn()
+        self.date = LabelColumn()
+        self.metric = LabelColumn()
+        self.value = array('d')
+        self.plant = LabelColumn()
+        self.part_name = LabelColumn()
+        # (source, first row index) and (sheet, first row index) runs; expanded only when a frame is built
+        self._sources = []
+        self._sheets = []
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def append(self, category, subcategory, date, metric, value, plant, part_name):
+        self.category.append(category)
+        self.subcategory.append(subcategory)
+        self.date.append(date)
+        self.metric.append(metric)
+        self.value.append(value)
+        self.plant.append(plant)
+        self.part_name.append(part_name)
+
+    def truncate(self, length):
+        """Drop rows past ``length`` (e.g. a workbook that failed part way)"""
+        for column in self._label_columns():
+            column.truncate(length)
+        del self.value[length:]
+        self._sources = [run for run in self._sources if run[1] < length]
+        self._sheets = [run for run in self._sheets if run[1] < length]
+
+    def _label_columns(self):
+        return (self.category, self.subcategory, self.date, self.metric, self.plant, self.part_name)
+
+    def columns(self):
+        """Column name -> list of Python values, in COLUMNS order"""
+        return {
+            'Category': self.category.values(),
+            'Subcategory': self.subcategory.values(),
+            'Date': self.date.values(),
+            'Metric': self.metric.values(),
+            'Value': self.value.tolist(),
+            'Plant': self.plant.values(),
+            'Part Name': self.part_name.values(),
+        }
+
+    def __iter__(self):
+        for row in zip(*self.columns().values()):
+            yield SmitchRecord(*row)
+
+    def begin_source(self, source):
+        """Tag rows appended from now on with ``source`` (e.g. the workbook path)"""
+        self._sources.append((source, len(self)))
+
+    def begin_sheet(self, sheet):
+        """Tag rows appended from now on with the worksheet name ``sheet``"""
+        self._sheets.append((sheet, len(self)))
+
+    def _runs(self, runs):
+        """(label, row count) for the non-empty runs, with None for untagged leading rows"""
+        starts = [start for _, start in runs] + [len(self)]
+        spans = [(None, starts[0])] if starts[0] > 0 else []
+        spans.extend((label, end - start) for (label, start), end in zip(runs, starts[1:]) if end > start)
+        return spans
+
+    def _run_codes(self, runs):
+        """Per-row codes into the unique run labels (-1 for untagged rows)"""
+        import numpy as np
+
+        labels = {}
+        codes, counts = [], []
+        for label, count in self._runs(runs):
+            codes.append(-1 if label is None else labels.setdefault(label, len(labels)))
+            counts.append(count)
+        return np.repeat(codes, counts), list(labels)
+
+    def fingerprint(self):
+        """Stable hash of the rows (order and sheet tags included, source tags excluded).
+
+        Two extractions that produce the same rows give the same fingerprint,
+        whatever else changed in the workbook.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        for name, column in (('Category', self.category), ('Subcategory', self.subcategory),
+                             ('Date', self.date), ('Metric', self.metric),
+                             ('Plant', self.plant), ('Part Name', self.part_name)):
+            h.update(name.encode())
+            # Labels and codes together pin down every row's value
+            h.update('\x1f'.join(column.labels).encode('utf-8', 'surrogatepass'))
+            h.update(column.codes.tobytes())
+        h.update(b'Value')
+        h.update(self.value.tobytes())
+        if self._sheets:
+            h.update(SHEET_COLUMN.encode())
+            for sheet, count in self._runs(self._sheets):
+                h.update(f"{sheet}\x1f{count}\x1e".encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def rows(self):
+        """(column names, iterator of row tuples), including the Source File/Sheet tags when set.
+
+        Rows are produced one at a time from the columns, for writers that
+        stream them out without building a DataFrame.
+        """
+        columns = self.columns()
+        for column, runs in ((SOURCE_COLUMN, self._sources), (SHEET_COLUMN, self._sheets)):
+            if runs:
+                columns[column] = chain.from_iterable(repeat(label, count) for label, count in self._runs(runs))
+        return list(columns), zip(*columns.values())
+
+    def to_dicts(self):
+        """Rows as dicts (every column present), for callers of the list-of-dicts API"""
+        return [dict(zip(COLUMNS, row)) for row in zip(*self.columns().values())]
+
+    def to_frame(self, categorical=True):
+        """Build a DataFrame; label columns become categoricals unless disabled"""
+        import numpy as np
+        import pandas as pd
+
+        values = np.frombuffer(self.value, dtype=np.float64).copy() if self.value else np.array([], dtype=np.float64)
+        data = {
+            'Category': self.category.to_array(categorical),
+            'Subcategory': self.subcategory.to_array(categorical),
+            'Date': self.date.to_array(categorical=False),
+            'Metric': self.metric.to_array(categorical),
+            'Value': values,
+            'Plant': self.plant.to_array(categorical),
+            'Part Name': self.part_name.to_array(categorical),
+        }
+        for column, runs in ((SOURCE_COLUMN, self._sources), (SHEET_COLUMN, self._sheets)):
+            if runs:
+                codes, labels = self._run_codes(runs)
+                tags = pd.Categorical.from_codes(codes, categories=pd.Index(labels, dtype=object))
+                data[column] = tags if categorical else np.asarray(tags)
+        return pd.DataFrame(data)
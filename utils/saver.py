@@ -1,10 +1,170 @@
-import pandas as pd
+import bz2
+import contextlib
+import csv
+import glob
+import gzip
+import io
+import json
+import lzma
+import os
 
-def save_to_excel(data, path):
-    # Convert list of dictionaries to DataFrame if necessary
+from utils.records import RecordBuffer
+
+PARQUET_PARTITION = 'Plant'
+UNKNOWN_PLANT = 'Unknown'
+# Arrow types of the non-label dataset columns; every other column is a dictionary-encoded string
+PARQUET_COLUMN_TYPES = {'Date': 'string', 'Value': 'float64'}
+
+# Codecs for the streaming text writers (csv, jsonl) and the suffix each adds
+COMPRESSION_EXTENSIONS = {'none': '', 'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+def to_frame(data):
+    # Convert a RecordBuffer or list of dictionaries to DataFrame if necessary
+    if isinstance(data, RecordBuffer):
+        return data.to_frame()
     if isinstance(data, list):
-        df = pd.DataFrame(data)
-    else:
-        df = data
-    
-    df.to_excel(path, index=False)
+        import pandas as pd
+        return pd.DataFrame(data)
+    return data
+
+def iter_rows(data):
+    """(column names, iterator of row tuples) for a RecordBuffer, list of dicts or DataFrame"""
+    if isinstance(data, RecordBuffer):
+        return data.rows()
+    if isinstance(data, list):
+        columns = list(dict.fromkeys(key for row in data for key in row))
+        return columns, (tuple(row.get(c) for c in columns) for row in data)
+    columns = [str(c) for c in data.columns]
+    return columns, data.astype(object).where(data.notna(), None).itertuples(index=False, name=None)
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """Yield a temp path next to ``path``; it replaces ``path`` only if the block succeeds.
+
+    The temp name is dot-prefixed (skipped by sync clients' readers and dataset
+    scans) and keeps the extension, which some writers use to pick a format.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".tmp-{name}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+@contextlib.contextmanager
+def open_text_output(path, compression='none'):
+    """Text stream writing to ``path`` through the given compression codec"""
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+    with open(path, 'wb') as raw:
+        if compression == 'gzip':
+            # No file name or timestamp in the header, so identical rows give identical bytes
+            binary = gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=6, mtime=0)
+        elif compression == 'bz2':
+            binary = bz2.BZ2File(raw, 'wb')
+        elif compression == 'xz':
+            binary = lzma.LZMAFile(raw, 'wb')
+        else:
+            binary = raw
+        text = io.TextIOWrapper(binary, encoding='utf-8', newline='', write_through=False)
+        try:
+            yield text
+        finally:
+            text.flush()
+            text.detach()
+            if binary is not raw:
+                binary.close()
+
+def save_to_excel(data, path):
+    df = to_frame(data)
+    with atomic_output(path) as tmp_path:
+        df.to_excel(tmp_path, index=False)
+
+def save_to_csv(data, path, compression='none'):
+    """Stream rows to a CSV file (header row first, empty cells for missing values)"""
+    columns, rows = iter_rows(data)
+    with atomic_output(path) as tmp_path, open_text_output(tmp_path, compression) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+def save_to_jsonl(data, path, compression='none'):
+    """Stream rows to a JSON-lines file, one object per row (null for missing values)"""
+    columns, rows = iter_rows(data)
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    with atomic_output(path) as tmp_path, open_text_output(tmp_path, compression) as f:
+        for row in rows:
+            f.write(encode(dict(zip(columns, row))))
+            f.write('\n')
+
+# Per-workbook output formats: format -> (file extension, writer(data, path, compression)).
+# Parquet is not listed: it writes into a partitioned dataset (save_to_parquet).
+OUTPUT_WRITERS = {
+    'xlsx': ('.xlsx', lambda data, path, compression: save_to_excel(data, path)),
+    'csv': ('.csv', save_to_csv),
+    'jsonl': ('.jsonl', save_to_jsonl),
+}
+
+def register_writer(fmt, extension, writer):
+    """Add an output format; ``writer(data, path, compression)`` must write ``path`` atomically"""
+    OUTPUT_WRITERS[fmt] = (extension, writer)
+
+def output_extension(fmt, compression='none'):
+    extension, _ = OUTPUT_WRITERS[fmt]
+    # xlsx is a zip archive already
+    return extension if fmt == 'xlsx' else extension + COMPRESSION_EXTENSIONS[compression]
+
+def save_output(data, fmt, path_stem, compression='none'):
+    """Write ``data`` as ``fmt`` to ``path_stem`` plus the format's extension; returns the path"""
+    _, writer = OUTPUT_WRITERS[fmt]
+    path = path_stem + output_extension(fmt, compression)
+    writer(data, path, compression)
+    return path
+
+def parquet_schema(columns):
+    """Fixed Arrow schema for the dataset columns.
+
+    Inferring types per file makes a column that is None in every row of one
+    workbook (Part Name, Date) Arrow type null, which then fails to unify
+    with the string type of the other files when the dataset is read.
+    """
+    import pyarrow as pa
+
+    label = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([(c, pa.type_for_alias(PARQUET_COLUMN_TYPES[c]) if c in PARQUET_COLUMN_TYPES else label)
+                      for c in columns])
+
+def save_to_parquet(data, dataset_dir, source_key):
+    """Replace one workbook's rows in the Plant-partitioned Parquet dataset.
+
+    Rows are written to ``<dataset_dir>/Plant=<plant>/<source_key>.parquet``
+    through a temp file + rename, and any earlier file for the same source
+    (possibly under another plant) is removed, so re-extraction is idempotent.
+    Returns the path written.
+    """
+    df = to_frame(data).copy()
+    plants = df[PARQUET_PARTITION].dropna() if PARQUET_PARTITION in df else []
+    plant = str(plants.iloc[0]) if len(plants) else UNKNOWN_PLANT
+    # The partition directory carries the plant; keeping the column too breaks hive readers
+    df = df.drop(columns=[PARQUET_PARTITION], errors='ignore')
+    df['Source File'] = source_key
+
+    partition_dir = os.path.join(dataset_dir, f"{PARQUET_PARTITION}={plant}")
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f"{source_key}.parquet")
+    # Dot-prefixed temp files are ignored by dataset readers while being written
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, schema=parquet_schema(df.columns), preserve_index=False)
+    with atomic_output(path) as tmp_path:
+        pq.write_table(table, tmp_path)
+
+    pattern = os.path.join(glob.escape(dataset_dir), f"{PARQUET_PARTITION}=*", glob.escape(f"{source_key}.parquet"))
+    for stale in glob.glob(pattern):
+        if os.path.abspath(stale) != os.path.abspath(path):
+            os.remove(stale)
+    return path
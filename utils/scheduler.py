@@ -0,0 +1,198 @@
+"""Per-file debounced work queue for the production watcher.
+
+File system events for a workbook arrive in bursts (Excel and OneDrive
+write, rename and touch the same file several times per save). Each path
+gets its own quiet-period timer; once it has been quiet for ``debounce``
+seconds it is queued and picked up by one of ``workers`` threads, so
+different files are processed concurrently and repeated events for the
+same file collapse into one run. Nothing here blocks the observer thread.
+"""
+
+import heapq
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DebouncedScheduler:
+    """Coalesce events per path and run ``handler(path)`` on a worker pool"""
+
+    def __init__(self, handler, debounce=2.0, min_interval=0.0, workers=2, name='smitch'):
+        self.handler = handler
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.workers = max(1, workers)
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._due = {}            # path -> time it may be queued
+        self._first_seen = {}     # path -> time of the first event in the current burst
+        self._heap = []           # (due, path); stale entries skipped lazily
+        self._queued = set()
+        self._running = set()
+        self._last_finished = {}  # path -> time its last run ended
+        self._deferred = {}       # path -> due time requested by defer() during its run
+        self._work = queue.Queue()
+        self._threads = []
+        self._stopping = False
+
+        self._stats = {
+            'events': 0,
+            'coalesced': 0,
+            'started': 0,
+            'processed': 0,
+            'errors': 0,
+            'deferred': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+            'last_wait': 0.0,
+        }
+
+    # -- lifecycle -------------------------------------------------------
+
+    def start(self):
+        dispatcher = threading.Thread(target=self._dispatch_loop, name=f'{self.name}-dispatch', daemon=True)
+        dispatcher.start()
+        self._threads.append(dispatcher)
+        for i in range(self.workers):
+            worker = threading.Thread(target=self._worker_loop, name=f'{self.name}-worker-{i}', daemon=True)
+            worker.start()
+            self._threads.append(worker)
+
+    def stop(self, timeout=None):
+        """Stop accepting work and wait for the runs in progress.
+
+        Files that are pending or queued but not started are dropped: the
+        manifest still has them as stale, so the next startup scan queues
+        them again, and a stop right after a large startup scan does not
+        have to work through the whole backlog first.
+        """
+        with self._cond:
+            self._stopping = True
+            dropped = len(self._due) + len(self._queued)
+            self._cond.notify_all()
+        if dropped:
+            logger.info(f"Dropped {dropped} file(s) not started yet; the next startup scan picks them up")
+        for _ in range(self.workers):
+            self._work.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # -- producer side ---------------------------------------------------
+
+    def submit(self, path, delay=None):
+        """Register an event for ``path``; (re)arms its quiet-period timer"""
+        now = time.time()
+        due = now + (self.debounce if delay is None else delay)
+        with self._cond:
+            if self._stopping:
+                return
+            self._stats['events'] += 1
+            if path in self._due or path in self._queued:
+                self._stats['coalesced'] += 1
+            if path in self._queued:
+                # Already waiting for a worker; it will read the latest file contents
+                return
+            self._first_seen.setdefault(path, now)
+            self._due[path] = due
+            heapq.heappush(self._heap, (due, path))
+            self._cond.notify()
+
+    def defer(self, path, delay):
+        """Called from the handler: retry ``path`` in ``delay`` seconds.
+
+        Unlike submit(), the current pass does not count as a run, so the
+        retry is not held back by ``min_interval`` and keeps its original
+        first-event time for the wait statistics.
+        """
+        with self._cond:
+            self._deferred[path] = time.time() + delay
+
+    # -- internals -------------------------------------------------------
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                # At most ``workers`` files are handed over at a time, so queued work
+                # stays cheap to drop on stop() and newer events can still coalesce
+                while self._heap and self._heap[0][0] <= now and self._has_capacity():
+                    due, path = heapq.heappop(self._heap)
+                    if self._due.get(path) != due:
+                        continue  # superseded by a later event
+                    if path in self._running:
+                        # One run at a time per file; re-check after it finishes
+                        self._rearm(path, now + self.debounce)
+                        continue
+                    not_before = self._last_finished.get(path, 0) + self.min_interval
+                    if not_before > now:
+                        self._rearm(path, not_before)
+                        continue
+                    del self._due[path]
+                    self._queued.add(path)
+                    self._work.put((path, self._first_seen.pop(path, now)))
+                if self._heap and self._heap[0][0] <= now:
+                    timeout = None  # due work waits for a worker; a finished run notifies
+                else:
+                    timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+
+    def _has_capacity(self):
+        return len(self._queued) + len(self._running) < self.workers
+
+    def _rearm(self, path, due):
+        self._due[path] = due
+        heapq.heappush(self._heap, (due, path))
+
+    def _worker_loop(self):
+        while True:
+            item = self._work.get()
+            if item is None:
+                return
+            path, first_seen = item
+            started = time.time()
+            with self._cond:
+                self._queued.discard(path)
+                if self._stopping:
+                    continue  # not started before stop(); dropped
+                self._running.add(path)
+                wait = started - first_seen
+                self._stats['started'] += 1
+                self._stats['total_wait'] += wait
+                self._stats['last_wait'] = wait
+                self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+            try:
+                self.handler(path)
+            except Exception as e:
+                with self._cond:
+                    self._stats['errors'] += 1
+                logger.error(f"Unhandled error processing {path}: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(path)
+                    retry_at = self._deferred.pop(path, None)
+                    if retry_at is not None and not self._stopping:
+                        self._stats['deferred'] += 1
+                        self._first_seen[path] = first_seen
+                        self._rearm(path, max(retry_at, self._due.get(path, 0)))
+                    else:
+                        self._last_finished[path] = time.time()
+                        self._stats['processed'] += 1
+                    self._cond.notify()
+
+    # -- introspection ---------------------------------------------------
+
+    def stats(self):
+        """Queue depth and wait-time figures for sizing the worker pool"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._due)
+            stats['queued'] = len(self._queued)
+            stats['in_progress'] = len(self._running)
+            stats['queue_depth'] = stats['pending'] + stats['queued']
+            stats['avg_wait'] = stats['total_wait'] / stats['started'] if stats['started'] else 0.0
+            del stats['total_wait']
+            return stats
@@ -0,0 +1,89 @@
+"""Read-once snapshot of a worksheet's used range.
+
+openpyxl's ``sheet.cell(row, column)`` is a dictionary lookup plus a Cell
+object per call (and silently creates cells outside the used range). The
+detectors in ``utils.extractor`` read the same cells many times per
+workbook, so the used range is materialized once into a dense list-of-rows
+grid with typed sidecar masks, and every detector reads from that instead.
+"""
+
+
+class SheetSnapshot:
+    """Dense, 1-based view of worksheet values with "is string" / "is numeric" masks"""
+
+    __slots__ = ('rows', 'str_mask', 'num_mask', 'max_row', 'max_column', 'title')
+
+    def __init__(self, rows, max_column=None, title=None):
+        rows = [list(r) for r in rows]
+        if max_column is None:
+            max_column = max((len(r) for r in rows), default=0)
+        for r in rows:
+            if len(r) < max_column:
+                r.extend([None] * (max_column - len(r)))
+            elif len(r) > max_column:
+                del r[max_column:]
+
+        self.rows = rows
+        self.max_row = len(rows)
+        self.max_column = max_column
+        self.title = title
+        # Sidecar masks mirror the type checks the detectors used to do per read
+        self.str_mask = [bytearray(isinstance(v, str) for v in r) for r in rows]
+        self.num_mask = [bytearray(isinstance(v, (int, float)) for v in r) for r in rows]
+
+    @classmethod
+    def from_worksheet(cls, ws, max_row=None, max_col=None):
+        """Materialize the used range of an openpyxl worksheet (optionally clipped)"""
+        n_rows = ws.max_row if max_row is None else min(max_row, ws.max_row)
+        n_cols = ws.max_column if max_col is None else min(max_col, ws.max_column)
+        if n_rows < 1 or n_cols < 1:
+            return cls([], max_column=0, title=ws.title)
+        rows = ws.iter_rows(min_row=1, max_row=n_rows, min_col=1, max_col=n_cols, values_only=True)
+        return cls(rows, max_column=n_cols, title=ws.title)
+
+    def value(self, row, column):
+        """Cell value at 1-based (row, column); None outside the used range"""
+        if 0 < row <= self.max_row and 0 < column <= self.max_column:
+            return self.rows[row - 1][column - 1]
+        return None
+
+    def text(self, row, column):
+        """Cell value if it is a string, else None"""
+        if 0 < row <= self.max_row and 0 < column <= self.max_column and self.str_mask[row - 1][column - 1]:
+            return self.rows[row - 1][column - 1]
+        return None
+
+    def touch(self, count):
+        """Hook for detectors that read ``rows`` directly; counted by CountingSnapshot"""
+
+
+class CountingSnapshot(SheetSnapshot):
+    """SheetSnapshot that counts cell reads, used by the per-stage timer"""
+
+    __slots__ = ('reads',)
+
+    @classmethod
+    def wrap(cls, snapshot):
+        counting = cls.__new__(cls)
+        for name in SheetSnapshot.__slots__:
+            setattr(counting, name, getattr(snapshot, name))
+        counting.reads = 0
+        return counting
+
+    def value(self, row, column):
+        self.reads += 1
+        return SheetSnapshot.value(self, row, column)
+
+    def text(self, row, column):
+        self.reads += 1
+        return SheetSnapshot.text(self, row, column)
+
+    def touch(self, count):
+        self.reads += count
+
+
+def as_snapshot(sheet):
+    """Return ``sheet`` unchanged if already a snapshot, else snapshot the worksheet"""
+    if isinstance(sheet, SheetSnapshot):
+        return sheet
+    return SheetSnapshot.from_worksheet(sheet)